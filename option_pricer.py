@@ -4,14 +4,20 @@ Copyright:      2018 xiaokang.guan All rights reserved.
 Description:    Option pricer.
 """
 
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 from utils.black_scholes import blackScholesOptionPrice
-from utils.binomial_tree import binomialTree
+from utils.binomial_tree import binomialTree, binomialTreeBatch
+from utils.monte_carlo import MonteCarloAccumulator, ControlVariateAccumulator, newSobolSampler, sobolNormals, \
+    gbmPathBlocks
 
 
 class EuropeanVanillaPricer():
 
-    def __init__(self, method='MC', callPut='Call', spot=100.0, strike=120, tenor=1.0, rate=0.0014, sigma=0.20, iterations=1e6):
+    def __init__(self, method='MC', callPut='Call', spot=100.0, strike=120, tenor=1.0, rate=0.0014, sigma=0.20, iterations=1e6,
+                 steps=2000, american=False, chunkSize=1e5, tolerance=None, confidence=0.95, varianceReduction=None,
+                 seed=None, workers=1, executor='process'):
         self.method = method
         self.callPut = callPut
         self.spot = spot
@@ -20,6 +26,25 @@ class EuropeanVanillaPricer():
         self.rate = rate
         self.sigma = sigma
         self.iterations = int(iterations)
+        # Binomial Tree settings
+        self.steps = int(steps)
+        self.american = american
+        # Monte Carlo settings, paths are simulated chunkSize at a time.
+        # tolerance is the target confidence interval half width, None means always run all iterations.
+        self.chunkSize = int(chunkSize)
+        self.tolerance = tolerance
+        self.confidence = confidence
+        # None for crude Monte Carlo, or 'antithetic', 'control' (underlying forward as control variate),
+        # 'sobol' (scrambled Sobol quasi-random normals)
+        self.varianceReduction = varianceReduction
+        # Paths are split across workers ('process' or 'thread' pool), each drawing from its own generator spawned
+        # from SeedSequence(seed). Prices are bit-reproducible for a given seed and number of workers.
+        self.seed = seed
+        self.workers = int(workers)
+        self.executor = executor
+        # Monte Carlo results of the last getMCPrice
+        self.standardError = None
+        self.pathsUsed = 0
  
     def getPrice(self):
         """ Calculate price using given method. """
@@ -35,28 +60,217 @@ class EuropeanVanillaPricer():
         Determine the option price using a Monte Carlo approach.
         The log return of underlying follow Normal distribution.
         s_T = s_t * exp((r - 1/2 * sig^2) * (T-t) + sig * sqrt(T-t) * sig_Normal)
+        Paths are processed in chunks of chunkSize, so memory stays constant regardless of iterations.
+        Stop early once the confidence interval half width of the price is within tolerance.
+        The standard error and the number of paths used are kept in standardError and pathsUsed.
+        For 'sobol', the standard error assumes independent draws and overstates the quasi-random error.
+        With several workers, paths are simulated in parallel and the partial results reduced at the end.
         """
-        calc = np.zeros([self.iterations, 2])
-        rand = np.random.normal(0, 1, [1, self.iterations])
+        discount = np.exp(-self.rate * self.tenor)
+        seedSequences = np.random.SeedSequence(self.seed).spawn(self.workers)
+        iterations = [self.iterations // self.workers + (1 if i < self.iterations % self.workers else 0)
+                      for i in range(self.workers)]
+        # Each worker stops on its own, its standard error is sqrt(workers) times the combined one
+        tolerance = None if self.tolerance is None else self.tolerance * np.sqrt(self.workers) / discount
+
+        if self.workers == 1:
+            results = [self._simulatePaths(seedSequences[0], iterations[0], tolerance)]
+        else:
+            poolClass = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+            with poolClass(max_workers=self.workers) as pool:
+                results = list(pool.map(self._simulatePaths, seedSequences, iterations, [tolerance] * self.workers))
+
+        # Reduce partial results in worker order, which keeps the price reproducible
+        accumulator, paths = results[0]
+        for workerAccumulator, workerPaths in results[1:]:
+            accumulator.merge(workerAccumulator)
+            paths += workerPaths
+
+        self.standardError = discount * accumulator.standardError()
+        self.pathsUsed = paths
+        return discount * accumulator.estimate()
+
+    def _simulatePaths(self, seedSequence, iterations, tolerance=None):
+        """
+        Simulate iterations paths chunk by chunk with a generator seeded from seedSequence.
+        Stop early once the undiscounted confidence interval half width is within tolerance.
+        Return (accumulator, number of paths simulated).
+        """
+        rng = np.random.default_rng(seedSequence)
+        if self.varianceReduction == 'control':
+            # Discounted terminal underlying is a martingale, i.e. E[s_T] is the forward
+            accumulator = ControlVariateAccumulator(self.spot * np.exp(self.rate * self.tenor))
+        else:
+            accumulator = MonteCarloAccumulator()
+
+        chunkSize = self.chunkSize
+        sampler = None
+        if self.varianceReduction == 'sobol':
+            # Power of 2 chunks keep the Sobol sequence balanced
+            chunkSize = 2 ** int(np.log2(chunkSize))
+            sampler = newSobolSampler(1, seed=rng)
+
+        paths = 0
+        while paths < iterations:
+            paths += self._simulateChunk(rng, accumulator, min(chunkSize, iterations - paths), sampler)
+
+            if tolerance is not None and accumulator.confidenceHalfWidth(self.confidence) <= tolerance:
+                break
+
+        return accumulator, paths
+
+    def _simulateChunk(self, rng, accumulator, size, sampler=None):
+        """
+        Simulate size paths of the terminal underlying and add their pay offs to the accumulator.
+        Antithetic pairs are added as one averaged sample, an odd size leaves one path without its pair which is added
+        on its own. Return the number of paths simulated, i.e. size.
+        """
+        if self.varianceReduction == 'sobol':
+            rand = sobolNormals(sampler, size)[:, 0]
+        elif self.varianceReduction == 'antithetic':
+            rand = rng.standard_normal(size // 2 + size % 2)
+        else:
+            rand = rng.standard_normal(size)
+
+        terminal = self._getTerminalPrices(rand)
+        payOffs = self._getPayOffs(terminal)
+
+        if self.varianceReduction == 'antithetic':
+            pairs = size // 2
+            accumulator.add(0.5 * (payOffs[:pairs] + self._getPayOffs(self._getTerminalPrices(-rand[:pairs]))))
+            accumulator.add(payOffs[pairs:])
+            return size
+        elif self.varianceReduction == 'control':
+            accumulator.add(payOffs, terminal)
+        else:
+            accumulator.add(payOffs)
+        return rand.size
+
+    def _getTerminalPrices(self, rand):
+        """ Underlying prices at expiry for the given standard normal draws. """
         mult = self.spot * np.exp(self.tenor * (self.rate - 0.5 * self.sigma**2))
+        return mult * np.exp(np.sqrt((self.sigma**2) * self.tenor) * rand)
 
+    def _getPayOffs(self, terminal):
+        """ Option pay offs for the given underlying prices at expiry. """
         if self.callPut == 'Call':
-            calc[:,1] = mult * np.exp(np.sqrt((self.sigma**2)*self.tenor) * rand) - self.strike
+            return np.maximum(terminal - self.strike, 0.0)
         elif self.callPut == 'Put':
-            calc[:,1] = self.strike - mult*np.exp(np.sqrt((self.sigma**2) * self.tenor) * rand)
-
-        avgPayOff = np.sum(np.amax(calc, axis=1)) / float(self.iterations)
-
-        return np.exp(-self.rate * self.tenor) * avgPayOff
+            return np.maximum(self.strike - terminal, 0.0)
 
     def getBSPrice(self):
         """ Determine the option price using the exact Black-Scholes expression. """
         return blackScholesOptionPrice(self.callPut, self.spot, self.strike, self.tenor, self.rate, self.sigma)
 
     def getBTPrice(self):
-        """ Determine the option price using Binomial Tree method"""
-        return binomialTree(self.callPut, self.spot, self.strike, self.rate, self.sigma, self.tenor, N=2000, american=False)
+        """
+        Determine the option price using Binomial Tree method.
+        If callPut / spot / strike / rate / sigma are arrays (e.g. a strike ladder), price all of them in one
+        lattice sweep and return an array of prices.
+        """
+        if all(np.ndim(x) == 0 for x in (self.callPut, self.spot, self.strike, self.rate, self.sigma)):
+            return binomialTree(self.callPut, self.spot, self.strike, self.rate, self.sigma, self.tenor,
+                                N=self.steps, american=self.american)
+        return binomialTreeBatch(self.callPut, self.spot, self.strike, self.rate, self.sigma, self.tenor,
+                                 N=self.steps, american=self.american)
  
     def applyPutCallParity(self, call):
         """ Make use of put-call parity to determine put price. """
         return self.strike * np.exp(-self.rate * self.tenor) - self.spot + call
+
+
+class PathDependentPricer(EuropeanVanillaPricer):
+    """
+    Monte Carlo pricer for path dependent options, e.g. Asian, barrier and lookback pay offs from utils.path_payoffs.
+    Takes the EuropeanVanillaPricer parameters (callPut, strike, chunkSize, tolerance, seed, workers etc.), plus
+    payOff: a PathPayOff reducer
+    steps: number of time steps per path
+    stepBlock: number of time steps simulated at once, memory is chunkSize x stepBlock regardless of steps
+    dtype: np.float32 to halve path memory
+    varianceReduction: None, or 'control' to use the terminal underlying as control variate.
+    """
+    def __init__(self, payOff, steps=252, stepBlock=64, dtype=np.float64, **kwargs):
+        kwargs.setdefault('method', 'MC')
+        super().__init__(**kwargs)
+        if self.varianceReduction not in (None, 'control'):
+            raise ValueError('Unsupported varianceReduction={} for path dependent options'.format(self.varianceReduction))
+        self.payOff = payOff
+        self.pathSteps = int(steps)
+        self.stepBlock = int(stepBlock)
+        self.dtype = dtype
+
+    def getPrice(self):
+        """ Path dependent options are only priced by Monte Carlo. """
+        return self.getMCPrice()
+
+    def _simulateChunk(self, rng, accumulator, size, sampler=None):
+        """ Simulate size paths block by block, reduce them into pay offs and add them to the accumulator. """
+        state = self.payOff.newState(size, self.spot)
+        for prices in gbmPathBlocks(rng, size, self.spot, self.rate, self.sigma, self.tenor, self.pathSteps,
+                                    self.stepBlock, self.dtype):
+            self.payOff.update(state, prices)
+        terminal = prices[:, -1].astype(np.float64)
+
+        payOffs = self.payOff.payOffs(state, terminal, self.callPut, self.strike)
+        if self.varianceReduction == 'control':
+            accumulator.add(payOffs, terminal)
+        else:
+            accumulator.add(payOffs)
+        return size
+
+
+def benchmarkVarianceReduction(iterations=2**16, replications=32, targetError=1.0e-3, **pricerArgs):
+    """
+    Compare crude Monte Carlo with each variance reduction technique on a European option.
+    Every technique is run replications times with iterations paths, the error is the root mean square error of the
+    replicated prices against blackScholesOptionPrice.
+    varianceReductionFactor is the crude mean square error over the technique's, timeToAccuracy extrapolates the
+    seconds needed to reach targetError assuming the error decays as 1 / sqrt(paths), which is conservative for Sobol.
+    Return a dict {technique: metrics}.
+    """
+    exact = EuropeanVanillaPricer(method='BS', **pricerArgs).getPrice()
+    result = dict()
+    for technique in (None, 'antithetic', 'control', 'sobol'):
+        pricer = EuropeanVanillaPricer(method='MC', iterations=iterations, varianceReduction=technique, **pricerArgs)
+        start = time.perf_counter()
+        prices = np.asarray([pricer.getPrice() for _ in range(replications)])
+        seconds = (time.perf_counter() - start) / replications
+        rmse = np.sqrt(np.mean((prices - exact) ** 2))
+        result[str(technique)] = {
+            'rmse': rmse,
+            'seconds': seconds,
+            'timeToAccuracy': seconds * (rmse / targetError) ** 2,
+        }
+
+    crudeMeanSquareError = result['None']['rmse'] ** 2
+    for metrics in result.values():
+        metrics['varianceReductionFactor'] = crudeMeanSquareError / metrics['rmse'] ** 2
+    return result
+
+
+def benchmarkParallelMonteCarlo(iterations=2e7, workerCounts=(1, 2, 4), executor='process', seed=2018, **pricerArgs):
+    """
+    Throughput of getMCPrice against the number of workers, and a reproducibility check of a second run.
+    Return a dict {workers: metrics}.
+    """
+    result = dict()
+    for workers in workerCounts:
+        pricer = EuropeanVanillaPricer(method='MC', iterations=iterations, seed=seed, workers=workers,
+                                       executor=executor, **pricerArgs)
+        start = time.perf_counter()
+        price = pricer.getPrice()
+        seconds = time.perf_counter() - start
+        result[workers] = {
+            'price': price,
+            'seconds': seconds,
+            'pathsPerSecond': pricer.pathsUsed / seconds,
+            'reproducible': price == pricer.getPrice(),
+        }
+    return result
+
+
+if __name__ == '__main__':
+    for technique, metrics in benchmarkVarianceReduction().items():
+        print(technique, metrics)
+    for workers, metrics in benchmarkParallelMonteCarlo().items():
+        print(workers, metrics)
@@ -0,0 +1,242 @@
+"""
+Benchmarks of the Magi backtest components.
+
+Run from the repository root, e.g. python -m strategies.magi.benchmark
+"""
+import datetime
+import multiprocessing
+import resource
+import time
+import numpy as np
+import pandas
+from strategies.magi.run import STOCKS_500, DATA_STORE_DIR, CAPITAL
+from utils.data_hub import DataHub
+from utils.data_store import LocalDataStore
+from utils.market_panel import MarketPanel
+from utils.rolling_window import RollingWindow
+from strategies.magi.config import Config, SD_PERIOD, LOOK_BACK_PERIOD, MA_SHORT_PERIOD, MA_LONG_PERIOD, \
+    TRIGGER_DISTANCE
+from strategies.magi.signals import precompute_signals
+from strategies.magi.x_man import xMan
+from strategies.magi.magi import Magi
+from utils.market_replay import MarketReplay
+from utils.trading_calendar import TradingCalendar
+from utils.market_tick import MarketTick
+
+
+class DictMarketTick:
+    """MarketTick as it was before __slots__, with a per instance __dict__, kept for comparison"""
+    def __init__(self, symbol, open, close, high, low, volume, close_return, dt_idx):
+        self.symbol = symbol
+        self.open = open
+        self.close = close
+        self.high = high
+        self.low = low
+        self.volume = volume
+        self.close_return = close_return
+        self.dt_idx = dt_idx
+
+
+def synthetic_symbol_data(symbols, start_date, end_date, seed=0):
+    """Random walk daily bars shaped as DataHub.downloadDataFromYahoo output, for runs without market data"""
+    rng = np.random.default_rng(seed)
+    dates = pandas.bdate_range(start_date, end_date, inclusive='left', name='Date')
+    symbol_data = dict()
+    for symbol in symbols:
+        close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.02, dates.size)))
+        df = pandas.DataFrame({
+            ('Close', symbol): close,
+            ('High', symbol): close * 1.01,
+            ('Low', symbol): close * 0.99,
+            ('Open', symbol): close * (1.0 + rng.normal(0.0, 0.005, dates.size)),
+            ('Volume', symbol): rng.integers(1e5, 1e7, dates.size).astype(float),
+        }, index=dates)
+        df.columns = pandas.MultiIndex.from_tuples(df.columns, names=['Price', 'Ticker'])
+        symbol_data[symbol] = df
+    return symbol_data
+
+
+def load_market_panel(symbols, start_date, end_date, synthetic=False):
+    if synthetic:
+        symbol_data = synthetic_symbol_data(symbols, start_date, end_date)
+    else:
+        symbol_data = DataHub(store=LocalDataStore(DATA_STORE_DIR)).downloadDataFromYahoo(start_date, end_date, symbols)
+    return MarketPanel.fromSymbolData(symbol_data, pandas.date_range(start_date, end_date, freq='B'))
+
+
+def _build_dict_market_ticks(panel):
+    market_ticks_by_day = dict()
+    for i, dt_idx in enumerate(panel.dates):
+        market_ticks_by_symbol = dict()
+        for j in np.flatnonzero(panel.valid[i]):
+            symbol = panel.symbols[j]
+            market_ticks_by_symbol[symbol] = DictMarketTick(
+                symbol, panel.open[i, j], panel.close[i, j], panel.high[i, j], panel.low[i, j], panel.volume[i, j],
+                panel.close_return[i, j], dt_idx)
+        market_ticks_by_day[dt_idx] = market_ticks_by_symbol
+    return market_ticks_by_day
+
+
+def _measure_market_ticks(tick_type, symbols, start_date, end_date, synthetic, results):
+    panel = load_market_panel(symbols, start_date, end_date, synthetic)
+    rss_panel = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if tick_type == 'slots':
+        market_ticks_by_day = panel.toDailyMarketTicks()
+    else:
+        market_ticks_by_day = _build_dict_market_ticks(panel)
+    elapsed = time.time() - start
+    ticks = sum(len(market_ticks_by_symbol) for market_ticks_by_symbol in market_ticks_by_day.values())
+    rss_ticks = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((tick_type, ticks, elapsed, rss_panel, rss_ticks))
+
+
+def benchmark_market_ticks_memory(symbols=STOCKS_500, start_date=datetime.date(2015, 1, 1),
+                                  end_date=datetime.date(2025, 1, 1), synthetic=False):
+    """
+    Peak RSS of the {date: {symbol: MarketTick}} backtest input, __slots__ MarketTick against the former __dict__
+    one. Each variant runs in a fresh process so that peak RSS (ru_maxrss, KB on Linux) is not shared.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    for tick_type in ['dict', 'slots']:
+        process = context.Process(target=_measure_market_ticks,
+                                  args=(tick_type, symbols, start_date, end_date, synthetic, results))
+        process.start()
+        tick_type, ticks, elapsed, rss_panel, rss_ticks = results.get()
+        process.join()
+        print('{:>5} ticks={} build={:.2f}s peak RSS panel={:.1f}MB with ticks={:.1f}MB ({:.0f} bytes per tick)'.format(
+            tick_type, ticks, elapsed, rss_panel / 1024.0, rss_ticks / 1024.0,
+            (rss_ticks - rss_panel) * 1024.0 / max(ticks, 1)))
+
+
+def _pandas_signal_metrics(values):
+    """Signal metrics as Magi computed them before rolling windows, growing a pandas Series tick by tick"""
+    metrics = []
+    ts = None
+    for i, value in enumerate(values):
+        tick = pandas.Series(data=[value], index=[i])
+        ts = tick if ts is None else pandas.concat([ts, tick])
+        metrics.append((ts.loc[:i][-SD_PERIOD:].std(), ts.loc[:i][-LOOK_BACK_PERIOD:].max(),
+                        ts.loc[:i][-LOOK_BACK_PERIOD:].min(), ts.loc[:i][-MA_SHORT_PERIOD:].mean(),
+                        ts.loc[:i][-MA_LONG_PERIOD:].mean()))
+    return np.array(metrics)
+
+
+def _rolling_signal_metrics(values):
+    windows = dict((period, RollingWindow(period))
+                   for period in {SD_PERIOD, LOOK_BACK_PERIOD, MA_SHORT_PERIOD, MA_LONG_PERIOD})
+    metrics = []
+    for value in values:
+        for window in windows.values():
+            window.append(value)
+        metrics.append((windows[SD_PERIOD].std(), windows[LOOK_BACK_PERIOD].max(), windows[LOOK_BACK_PERIOD].min(),
+                        windows[MA_SHORT_PERIOD].mean(), windows[MA_LONG_PERIOD].mean()))
+    return np.array(metrics)
+
+
+def benchmark_rolling_signals(days=2500, seed=0):
+    """
+    Magi signal metrics (sd, highest, lowest, ma_short, ma_long) of one symbol's close returns, pandas Series
+    against RollingWindow. Agreement is checked by tests/test_rolling_window.py, the max difference is reported.
+    """
+    rng = np.random.default_rng(seed)
+    close_returns = rng.normal(0.0, 0.02, days)
+    # First return of a symbol is NaN, as out of pct_change
+    close_returns[0] = np.nan
+
+    start = time.time()
+    expected = _pandas_signal_metrics(close_returns)
+    pandas_elapsed = time.time() - start
+    start = time.time()
+    actual = _rolling_signal_metrics(close_returns)
+    rolling_elapsed = time.time() - start
+
+    print('days={} pandas={:.3f}s rolling={:.3f}s max abs diff={:.3g}'.format(
+        days, pandas_elapsed, rolling_elapsed, np.nanmax(np.abs(expected - actual))))
+
+
+def _magi_backtest(panel, model_name, precompute):
+    """Daily flow of run.execute, return xMan and the seconds spent in Magi, precompute_signals included"""
+    # Stop 2 days short of the calendar, mispricing closes its trades 2 trading days later
+    replay = MarketReplay(panel, endDate=panel.dates[-3])
+    x_man = xMan(CAPITAL, 0.0)
+    config = Config(symbols=list(panel.symbols), stop_order_pct=None, limit_order_pct=None)
+    start = time.perf_counter()
+    signals = precompute_signals(panel, config, model_name) if precompute else None
+    magi_elapsed = time.perf_counter() - start
+    magi = Magi(CAPITAL, x_man, config, TradingCalendar(panel.dates), model_name, signals)
+    for dt_idx, market_ticks_by_symbol in replay:
+        x_man.run_on_market_ticks(market_ticks_by_symbol)
+        x_man.evaluate_performance()
+        start = time.perf_counter()
+        magi.run_on_market_ticks(market_ticks_by_symbol)
+        magi_elapsed += time.perf_counter() - start
+    return x_man, magi_elapsed
+
+
+def benchmark_precomputed_signals(symbols=STOCKS_500, start_date=datetime.date(2015, 1, 1),
+                                  end_date=datetime.date(2025, 1, 1), synthetic=True,
+                                  model_name='price_mean_reversion'):
+    """
+    Backtest of the whole universe with Magi computing its signals tick by tick, against precompute_signals.
+    Orders must be placed on the same (date, symbol) triggers; stop / limit prices derived from ma_long / sd may
+    differ by the pandas rolling rounding, the max relative difference is reported.
+    Return a dict of seconds spent in Magi for both, xMan time is left out.
+    """
+    panel = load_market_panel(symbols, start_date, end_date, synthetic)
+    x_man_tick, tick_elapsed = _magi_backtest(panel, model_name, precompute=False)
+    x_man_precomputed, precompute_elapsed = _magi_backtest(panel, model_name, precompute=True)
+
+    orders_tick, orders_precomputed = list(x_man_tick.orders), list(x_man_precomputed.orders)
+    assert [(order.symbol, order.type, order.open_dt_idx) for order in orders_tick] == \
+        [(order.symbol, order.type, order.open_dt_idx) for order in orders_precomputed]
+    max_price_diff = max([abs(tick.price - precomputed.price) / abs(tick.price)
+                          for tick, precomputed in zip(orders_tick, orders_precomputed)
+                          if not np.isnan(tick.price)] or [0.0])
+    result = {
+        'symbols': len(panel.symbols),
+        'days': len(panel.dates),
+        'orders': len(orders_tick),
+        'tickByTick': tick_elapsed,
+        'precomputed': precompute_elapsed,
+        'maxRelativePriceDiff': max_price_diff,
+    }
+    print(result)
+    return result
+
+
+def benchmark_symbol_lookups(universe_sizes=(50, 100, 250, 500), days=50):
+    """
+    Daily xMan position / performance lookups over the whole universe, as update_mtm_on_market_tick and
+    evaluate_performance do, symbol keyed maps against the former linear scans of lists.
+    Cost per symbol per day should stay flat with the universe size for the maps.
+    """
+    for size in universe_sizes:
+        symbols = STOCKS_500[:size]
+        x_man = xMan(CAPITAL, 0.0)
+        for symbol in symbols:
+            x_man.update_mtm_on_market_tick(MarketTick(symbol, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0, None))
+        positions = list(x_man.positions)
+
+        start = time.time()
+        for _ in range(days):
+            for symbol in symbols:
+                x_man.get_position_by_symbol(symbol).update_mtm(1.0)
+        mapped = (time.time() - start) / days / size
+
+        start = time.time()
+        for _ in range(days):
+            for symbol in symbols:
+                next(position for position in positions if position.symbol == symbol).update_mtm(1.0)
+        scanned = (time.time() - start) / days / size
+
+        print('symbols={} per symbol per day: map={:.2f}us list scan={:.2f}us'.format(
+            size, mapped * 1e6, scanned * 1e6))
+
+
+if __name__ == '__main__':
+    benchmark_rolling_signals()
+    benchmark_precomputed_signals()
+    benchmark_symbol_lookups()
+    benchmark_market_ticks_memory()
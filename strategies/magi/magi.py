@@ -1,7 +1,8 @@
 from utils.order import Order, ORDER_TYPE_MARKET, ORDER_TYPE_LIMIT, ORDER_TYPE_STOP, ORDER_DIRECTION_BUY, ORDER_DIRECTION_SELL
+from strategies.magi.signals import new_signal_windows
 import logging
 import math
-import pandas
+import numpy as np
 
 
 class Magi:
@@ -10,13 +11,18 @@ class Magi:
                  x_man,
                  config,
                  trading_calendar,
-                 model_name):
+                 model_name,
+                 signals=None):
         self.capital = capital
         self.x_man = x_man
+        # symbol: {period: RollingWindow} of the series the model runs on, and the number of ticks seen
         self.symbol_data = dict()
+        self.symbol_ticks = dict()
         self.capital_used = 0
         self.trading_calendar = trading_calendar
         self.model_name = model_name
+        # Optional MagiSignals precomputed for the whole backtest, looked up instead of computed tick by tick
+        self.signals = signals
 
         # Strategy config
         self.config = config
@@ -27,6 +33,10 @@ class Magi:
             'focus_stock': self._run_mispricing,
             'price_mean_reversion': self._run_price_mean_reversion,
         }
+        self.TRADE_MAP = {
+            'focus_stock': self._trade_mispricing,
+            'price_mean_reversion': self._trade_price_mean_reversion,
+        }
 
     def __str__(self):
         return 'He is my shield!'
@@ -37,6 +47,18 @@ class Magi:
                    self.config.ma_short_period,
                    self.config.ma_long_period)
 
+    def _update_symbol_data(self, symbol, value):
+        """Append value to the rolling windows of the symbol, one per config period, return them by period"""
+        windows = self.symbol_data.get(symbol)
+        if windows is None:
+            windows = new_signal_windows(self.config)
+            self.symbol_data[symbol] = windows
+            self.symbol_ticks[symbol] = 0
+        for window in windows.values():
+            window.append(value)
+        self.symbol_ticks[symbol] += 1
+        return windows
+
     def get_order_size(self, price):
         """Estimate the order size based on the current price and order limit"""
         # Limit the max allowed portfolio exposure (i.e. MTM) by initialCapital and available cash and manual limit.
@@ -71,140 +93,165 @@ class Magi:
         """
         Run strategy for the market_tick given for a specific symbol.
         Signal is based on daily price returns.
-        The strategy probably also depends on past market_ticks, which need to be looked up in self.symbol_data
+        The strategy probably also depends on past market_ticks, which need to be looked up in self.symbol_data rolling windows
         Place orders based on strategy signals
         """
-        # Update timeseries on daily market_tick Close
-        ts = pandas.Series(data=[market_tick.close_return], index=[market_tick.dt_idx])
-        if self.symbol_data.get(market_tick.symbol, None) is None:
-            self.symbol_data[market_tick.symbol] = ts
-        else:
-            ts_new = pandas.concat([self.symbol_data[market_tick.symbol], ts])
-            self.symbol_data[market_tick.symbol] = ts_new
+        # Update rolling windows on daily market_tick Close return
+        windows = self._update_symbol_data(market_tick.symbol, market_tick.close_return)
 
         # Check if enough data for running strategy
-        ts = self.symbol_data[market_tick.symbol]
-        if len(ts) < self.get_start_index() + 1:
+        if self.symbol_ticks[market_tick.symbol] < self.get_start_index() + 1:
             logging.debug('Magi: run: dt_idx={}: Not enough data to run Magi.'.format(market_tick.dt_idx))
             return
 
         # Calculate signal metrics
-        sd = ts[:market_tick.dt_idx][-self.config.sd_period:].std()
-        highest = ts[:market_tick.dt_idx][-self.config.look_back_period:].max()
-        lowest = ts[:market_tick.dt_idx][-self.config.look_back_period:].min()
-        ma_short = ts[:market_tick.dt_idx][-self.config.ma_short_period:].mean()
-        ma_long = ts[:market_tick.dt_idx][-self.config.ma_long_period:].mean()
+        sd = windows[self.config.sd_period].std()
+        highest = windows[self.config.look_back_period].max()
+        lowest = windows[self.config.look_back_period].min()
+        ma_short = windows[self.config.ma_short_period].mean()
+        ma_long = windows[self.config.ma_long_period].mean()
         curr_price = market_tick.close
         curr_return = market_tick.close_return
 
         logging.info('Magi: run_strategy_on_market_tick: curr_price={}, curr_return={}, ma_long={}, sd={}, distance={}, ma_short={}'.format(curr_price, curr_return, ma_long, sd, (curr_return - ma_long) / sd, ma_short))
         if curr_return < ma_long - sd * self.config.trigger_distance:
-            quantity = self.get_order_size(curr_price)
-
-            # TODO: Without knowledge of the next market_tick, we place orders based on current market_tick
-            if quantity > 0:
-                market_order = Order(market_tick.symbol,
-                                     ORDER_DIRECTION_BUY,
-                                     ORDER_TYPE_MARKET,
-                                     float('nan'),
-                                     quantity,
-                                     market_tick.dt_idx)
-                self.x_man.place_order(market_order)
-                logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY: Placed marketOrder={}'.format(market_order))
-
-                # Idea is to manually close position next day, instead of replying on Limit / Stop orders
-                close_market_order = Order(market_tick.symbol,
-                                           ORDER_DIRECTION_SELL,
-                                           ORDER_TYPE_MARKET,
-                                           float('nan'),
-                                           quantity,
-                                           market_tick.dt_idx,
-                                           valid_from_dt_idx=self.trading_calendar[self.trading_calendar.index(market_tick.dt_idx)+2],
-                                           valid_to_dt_idx=None)
-                self.x_man.place_order(close_market_order)
-                logging.info('Magi: run_strategy_on_market_tick: Placed close_market_order={}'.format(close_market_order))
-
-                self.x_man.link_orders([market_order, close_market_order])
-
-                # Update daily capital used
-                self.capital_used += quantity * curr_price
-            else:
-                logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY, but cannot trade due to quantity=0, market_tick={}'.format(market_tick))
+            self._trade_mispricing(market_tick, ma_long, sd)
+
+    def _trade_mispricing(self, market_tick, ma_long, sd):
+        """Place the buy order and its close order on a mispricing trigger"""
+        curr_price = market_tick.close
+        quantity = self.get_order_size(curr_price)
+
+        # TODO: Without knowledge of the next market_tick, we place orders based on current market_tick
+        if quantity > 0:
+            market_order = Order(market_tick.symbol,
+                                 ORDER_DIRECTION_BUY,
+                                 ORDER_TYPE_MARKET,
+                                 float('nan'),
+                                 quantity,
+                                 market_tick.dt_idx)
+            self.x_man.place_order(market_order)
+            logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY: Placed marketOrder={}'.format(market_order))
+
+            # Idea is to manually close position next day, instead of replying on Limit / Stop orders
+            close_market_order = Order(market_tick.symbol,
+                                       ORDER_DIRECTION_SELL,
+                                       ORDER_TYPE_MARKET,
+                                       float('nan'),
+                                       quantity,
+                                       market_tick.dt_idx,
+                                       valid_from_dt_idx=self.trading_calendar.offset(market_tick.dt_idx, 2),
+                                       valid_to_dt_idx=None)
+            self.x_man.place_order(close_market_order)
+            logging.info('Magi: run_strategy_on_market_tick: Placed close_market_order={}'.format(close_market_order))
+
+            self.x_man.link_orders([market_order, close_market_order])
+
+            # Update daily capital used
+            self.capital_used += quantity * curr_price
+        else:
+            logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY, but cannot trade due to quantity=0, market_tick={}'.format(market_tick))
 
     def _run_price_mean_reversion(self, market_tick):
         """
         Run strategy for the market_tick given for a specific symbol.
         Signal is based on daily stock price.
-        The strategy probably also depends on past market_ticks, which need to be looked up in self.symbol_data
+        The strategy probably also depends on past market_ticks, which need to be looked up in self.symbol_data rolling windows
         Place orders based on strategy signals
         """
-        # Update timeseries on daily market_tick Close
-        ts = pandas.Series(data=[market_tick.close], index=[market_tick.dt_idx])
-        if self.symbol_data.get(market_tick.symbol, None) is None:
-            self.symbol_data[market_tick.symbol] = ts
-        else:
-            ts_new = pandas.concat([self.symbol_data[market_tick.symbol], ts])
-            self.symbol_data[market_tick.symbol] = ts_new
+        # Update rolling windows on daily market_tick Close
+        windows = self._update_symbol_data(market_tick.symbol, market_tick.close)
 
         # Check if enough data for running strategy
-        ts = self.symbol_data[market_tick.symbol]
-        if len(ts) < self.get_start_index() + 1:
+        if self.symbol_ticks[market_tick.symbol] < self.get_start_index() + 1:
             logging.debug('Magi: run: dt_idx={}: Not enough data to run Magi.'.format(market_tick.dt_idx))
             return
 
         # Calculate signal metrics
-        sd = ts[:market_tick.dt_idx][-self.config.sd_period:].std()
-        highest = ts[:market_tick.dt_idx][-self.config.look_back_period:].max()
-        lowest = ts[:market_tick.dt_idx][-self.config.look_back_period:].min()
-        ma_short = ts[:market_tick.dt_idx][-self.config.ma_short_period:].mean()
-        ma_long = ts[:market_tick.dt_idx][-self.config.ma_long_period:].mean()
+        sd = windows[self.config.sd_period].std()
+        highest = windows[self.config.look_back_period].max()
+        lowest = windows[self.config.look_back_period].min()
+        ma_short = windows[self.config.ma_short_period].mean()
+        ma_long = windows[self.config.ma_long_period].mean()
         curr_price = market_tick.close
         curr_return = market_tick.close_return
 
         logging.info('Magi: run_strategy_on_market_tick: curr_price={}, curr_return={}, ma_long={}, sd={}, distance={}, ma_short={}'.format(curr_price, curr_return, ma_long, sd, (curr_price - ma_long) / sd, ma_short))
         if curr_price < ma_long - sd * self.config.trigger_distance:
-            quantity = self.get_order_size(curr_price)
-
-            # TODO: Without knowledge of the next market_tick, we place orders based on current market_tick
-            if quantity > 0:
-                market_order = Order(market_tick.symbol,
-                                     ORDER_DIRECTION_BUY,
-                                     ORDER_TYPE_MARKET,
-                                     float('nan'),
-                                     quantity,
-                                     market_tick.dt_idx)
-                self.x_man.place_order(market_order)
-                logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY: Placed marketOrder={}'.format(market_order))
-
-                stop_order = Order(market_tick.symbol,
-                                   ORDER_DIRECTION_SELL,
-                                   ORDER_TYPE_STOP,
-                                   float('nan'),
-                                   quantity,
-                                   market_tick.dt_idx,
-                                   pct_from_market=self.get_stop_pct_from_market(ma_long, sd))
-                self.x_man.place_order(stop_order)
-                logging.info('Magi: run_strategy_on_market_tick: Placed stop_order={}'.format(stop_order))
-
-                limit_order = Order(market_tick.symbol,
-                                    ORDER_DIRECTION_SELL,
-                                    ORDER_TYPE_LIMIT,
-                                    float('nan'),
-                                    quantity,
-                                    market_tick.dt_idx,
-                                    pct_from_market=self.get_limit_pct_from_market(ma_long, sd))
-                self.x_man.place_order(limit_order)
-                logging.info('Magi: run_strategy_on_market_tick: Placed limit_order={}'.format(limit_order))
-
-                self.x_man.link_orders([market_order, stop_order, limit_order])
-
-                # Update daily capital used
-                self.capital_used += quantity * curr_price
-            else:
-                logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY, but cannot trade due to quantity=0, market_tick={}'.format(market_tick))
+            self._trade_price_mean_reversion(market_tick, ma_long, sd)
+
+    def _trade_price_mean_reversion(self, market_tick, ma_long, sd):
+        """Place the buy order and its stop / limit orders on a price mean reversion trigger"""
+        curr_price = market_tick.close
+        quantity = self.get_order_size(curr_price)
+
+        # TODO: Without knowledge of the next market_tick, we place orders based on current market_tick
+        if quantity > 0:
+            market_order = Order(market_tick.symbol,
+                                 ORDER_DIRECTION_BUY,
+                                 ORDER_TYPE_MARKET,
+                                 float('nan'),
+                                 quantity,
+                                 market_tick.dt_idx)
+            self.x_man.place_order(market_order)
+            logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY: Placed marketOrder={}'.format(market_order))
+
+            stop_order = Order(market_tick.symbol,
+                               ORDER_DIRECTION_SELL,
+                               ORDER_TYPE_STOP,
+                               float('nan'),
+                               quantity,
+                               market_tick.dt_idx,
+                               pct_from_market=self.get_stop_pct_from_market(ma_long, sd))
+            self.x_man.place_order(stop_order)
+            logging.info('Magi: run_strategy_on_market_tick: Placed stop_order={}'.format(stop_order))
+
+            limit_order = Order(market_tick.symbol,
+                                ORDER_DIRECTION_SELL,
+                                ORDER_TYPE_LIMIT,
+                                float('nan'),
+                                quantity,
+                                market_tick.dt_idx,
+                                pct_from_market=self.get_limit_pct_from_market(ma_long, sd))
+            self.x_man.place_order(limit_order)
+            logging.info('Magi: run_strategy_on_market_tick: Placed limit_order={}'.format(limit_order))
+
+            self.x_man.link_orders([market_order, stop_order, limit_order])
+
+            # Update daily capital used
+            self.capital_used += quantity * curr_price
+        else:
+            logging.info('Magi: run_strategy_on_market_tick: TRIGGER BUY, but cannot trade due to quantity=0, market_tick={}'.format(market_tick))
+
+    def _run_precomputed(self, market_tick):
+        """Run strategy for the market_tick given, looking its signal up in self.signals"""
+        i = self.signals.get_ordinal(market_tick)
+        j = self.signals.symbol_index[market_tick.symbol]
+        if self.signals.trigger[i, j]:
+            ma_long = self.signals.ma_long[i, j]
+            sd = self.signals.sd[i, j]
+            logging.info('Magi: run_strategy_on_market_tick: precomputed trigger symbol={}, curr_price={}, '
+                         'curr_return={}, ma_long={}, sd={}'.format(market_tick.symbol, market_tick.close,
+                                                                   market_tick.close_return, ma_long, sd))
+            self.TRADE_MAP[self.model_name](market_tick, ma_long, sd)
+
+    def _get_triggered_symbols(self, market_ticks_by_symbol):
+        """Symbols with a precomputed trigger on the day of market_ticks_by_symbol, looked up once for the day"""
+        market_tick = next(iter(market_ticks_by_symbol.values()), None)
+        if market_tick is None:
+            return set()
+        i = self.signals.get_ordinal(market_tick)
+        return set(self.signals.symbols[j] for j in np.flatnonzero(self.signals.trigger[i]))
 
     def run_on_market_ticks(self, market_ticks_by_symbol):
         self.capital_used = 0
+        symbols = set(self.config.symbols)
+        if self.signals is not None:
+            # Only triggered symbols trade, in the order of the market ticks as tick by tick
+            symbols &= self._get_triggered_symbols(market_ticks_by_symbol)
         for symbol, market_tick in market_ticks_by_symbol.items():
-            if symbol in self.config.symbols:
-                self.MODEL_MAP[self.model_name](market_tick)
+            if symbol in symbols:
+                if self.signals is not None:
+                    self._run_precomputed(market_tick)
+                else:
+                    self.MODEL_MAP[self.model_name](market_tick)
@@ -0,0 +1,96 @@
+import logging
+import numpy as np
+import pandas
+from utils.rolling_window import RollingWindow
+
+# Series each model runs on, as MarketPanel field
+MODEL_SERIES = {
+    'focus_stock': 'close_return',
+    'price_mean_reversion': 'close',
+}
+
+
+class MagiSignals:
+    """
+    Magi signal metrics and trigger mask precomputed for every date and symbol of a MarketPanel, as
+    (dates x symbols) arrays aligned with the panel, NaN / False where the symbol has no tick or not enough history.
+    """
+    def __init__(self, dates, symbols, sd, highest, lowest, ma_short, ma_long, trigger):
+        self.dates = dates
+        self.symbols = symbols
+        self.sd = sd
+        self.highest = highest
+        self.lowest = lowest
+        self.ma_short = ma_short
+        self.ma_long = ma_long
+        self.trigger = trigger
+        self.symbol_index = dict((symbol, j) for j, symbol in enumerate(symbols))
+        self.ordinals = dict((dt_idx, i) for i, dt_idx in enumerate(dates))
+
+    def __str__(self):
+        return 'MagiSignals<dates={}, symbols={}, triggers={}>'.format(
+            len(self.dates), len(self.symbols), np.count_nonzero(self.trigger))
+
+    def get_ordinal(self, market_tick):
+        """Panel row of the market_tick, dt_ordinal if the tick comes from the same panel"""
+        if market_tick.dt_ordinal is not None and market_tick.dt_ordinal < len(self.dates) and \
+                self.dates[market_tick.dt_ordinal] == market_tick.dt_idx:
+            return market_tick.dt_ordinal
+        return self.ordinals[market_tick.dt_idx]
+
+
+def new_signal_windows(config):
+    """{period: RollingWindow} of the signal metrics of one symbol, one per config period"""
+    periods = {config.sd_period, config.look_back_period, config.ma_short_period, config.ma_long_period}
+    return dict((period, RollingWindow(period)) for period in periods)
+
+
+def precompute_signals(panel, config, model_name):
+    """
+    Compute the Magi signal metrics of all the config symbols at once, with pandas rolling windows over each
+    symbol's own ticks, i.e. the panel rows where it is valid, as Magi sees them tick by tick.
+    The ticks of every symbol are packed to the top of one (ticks x symbols) frame, NaN padded below, so each
+    metric is a single rolling call over the whole universe.
+    highest / lowest and the triggers are those of the tick by tick RollingWindow path. pandas rolling updates
+    mean / std by its own add / remove sums, so ma_long / sd, and the stop / limit pct derived from them, agree
+    with RollingWindow to about 1e-12 relative only, see tests/test_magi.py.
+    """
+    shape = panel.close.shape
+    metrics = dict((name, np.full(shape, np.nan)) for name in ['sd', 'highest', 'lowest', 'ma_short', 'ma_long'])
+    trigger = np.zeros(shape, dtype=bool)
+    values = getattr(panel, MODEL_SERIES[model_name])
+    start_index = max(config.sd_period, config.look_back_period, config.ma_short_period, config.ma_long_period)
+
+    columns = [panel.symbolIndex[symbol] for symbol in dict.fromkeys(config.symbols) if symbol in panel.symbolIndex]
+    if not columns:
+        return MagiSignals(panel.dates, panel.symbols, trigger=trigger, **metrics)
+    valid = panel.valid[:, columns]
+    # k-th tick of each symbol at row k of the packed frame, and its panel row
+    ticks = np.cumsum(valid, axis=0) - 1
+    rows, packed_columns = np.nonzero(valid)
+    packed_rows = ticks[rows, packed_columns]
+    packed = np.full((max(int(valid.sum(axis=0).max()), 1), len(columns)), np.nan)
+    packed[packed_rows, packed_columns] = values[rows, np.asarray(columns)[packed_columns]]
+
+    frame = pandas.DataFrame(packed)
+    packed_metrics = {
+        'sd': frame.rolling(config.sd_period, min_periods=1).std().to_numpy(),
+        'highest': frame.rolling(config.look_back_period, min_periods=1).max().to_numpy(),
+        'lowest': frame.rolling(config.look_back_period, min_periods=1).min().to_numpy(),
+        'ma_short': frame.rolling(config.ma_short_period, min_periods=1).mean().to_numpy(),
+        'ma_long': frame.rolling(config.ma_long_period, min_periods=1).mean().to_numpy(),
+    }
+
+    # Magi runs from the (start_index + 1)-th tick of the symbol
+    enough = packed_rows >= start_index
+    rows, packed_columns, packed_rows = rows[enough], packed_columns[enough], packed_rows[enough]
+    panel_columns = np.asarray(columns)[packed_columns]
+    for name, packed_metric in packed_metrics.items():
+        metrics[name][rows, panel_columns] = packed_metric[packed_rows, packed_columns]
+    sd = metrics['sd'][rows, panel_columns]
+    ma_long = metrics['ma_long'][rows, panel_columns]
+    trigger[rows, panel_columns] = values[rows, panel_columns] < ma_long - sd * config.trigger_distance
+
+    logging.info('precompute_signals: model_name={}, symbols={}, triggers={}'.format(
+        model_name, len(config.symbols), np.count_nonzero(trigger)))
+    return MagiSignals(panel.dates, panel.symbols, trigger=trigger, **metrics)
@@ -1,67 +1,76 @@
-import copy
 import uuid
 import logging
 import datetime
-import pandas
-from utils.order import ORDER_STATE_NEW, ORDER_STATE_PARTIALLY_FILLED, ORDER_STATE_FULLY_FILLED, ORDER_STATE_CANCELLED, \
-    ORDER_TYPE_MARKET, ORDER_TYPE_LIMIT, ORDER_TYPE_STOP, ORDER_DIRECTION_BUY, ORDER_DIRECTION_SELL
+from utils.order import ORDER_STATE_NEW, ORDER_STATE_PARTIALLY_FILLED, ORDER_STATE_FULLY_FILLED, \
+    ORDER_STATE_CANCELLED, ORDER_TYPE_MARKET, ORDER_TYPE_LIMIT, ORDER_TYPE_STOP, ORDER_DIRECTION_BUY, \
+    ORDER_DIRECTION_SELL
+from utils.order_book import OrderBook, SymbolOrderStatistics
 from utils.position import Position
 from utils.portfolio import Portfolio
 from utils.performance import Performance
-from utils.performance_evaluation import annualized_return, annualized_volatility, sharpe_ratio
+from utils.symbol_map import SymbolMap
+from utils.portfolio_history import PortfolioHistory
 
 
 class xMan:
-    def __init__(self, initial_capital, risk_free):
-        self.orders = []
-        self.positions = []
+    def __init__(self, initial_capital, risk_free, check_consistency=False):
+        """
+        check_consistency: verify the running portfolio totals and order statistics against a full recompute every
+        day, for tests
+        """
+        self.orders = OrderBook()
+        self.positions = SymbolMap()
         self.portfolio = Portfolio(initial_capital)
-        self.historical_portfolios = []
-        self.symbol_performances = []
+        self.portfolio_history = PortfolioHistory()
+        self.symbol_performances = SymbolMap()
         self.initial_capital = initial_capital
         self.portfolio_max_capital_required = 0
         self.portfolio_success = 0
         self.portfolio_failure = 0
         self.portfolio_total_trade_life = datetime.timedelta()
         self.risk_free = risk_free
+        self.check_consistency = check_consistency
 
     def place_order(self, order):
-        self.orders.append(order)
+        self.orders.add(order)
 
     def get_order_by_order_id(self, order_id):
         """Return a single order or None given the unique order_id"""
-        for order in self.orders:
-            if order.order_id == order_id:
-                return order
-        logging.debug('xMan: get_order_by_order_id: No order found for order_id={}'.format(order_id))
+        order = self.orders.get_order_by_order_id(order_id)
+        if order is None:
+            logging.debug('xMan: get_order_by_order_id: No order found for order_id={}'.format(order_id))
+        return order
 
     def get_orders_by_link_id(self, link_id):
         """Return a list of orders given the link_id"""
-        orders = []
-        for order in self.orders:
-            if order.link_id and order.link_id == link_id:
-                orders.append(order)
-        return orders
+        if not link_id:
+            return []
+        return self.orders.get_orders_by_link_id(link_id)
 
     def get_orders_by_symbol(self, symbol):
         """Return a list of orders given the symbol"""
-        orders = []
-        for order in self.orders:
-            if order.symbol == symbol:
-                orders.append(order)
-        return orders
+        return self.orders.get_orders_by_symbol(symbol)
 
     def get_position_by_symbol(self, symbol):
-        for position in self.positions:
-            if position.symbol == symbol:
-                return position
-        logging.debug('xMan: get_position_by_symbol: No position found for symbol={}'.format(symbol))
+        position = self.positions.get(symbol)
+        if position is None:
+            logging.debug('xMan: get_position_by_symbol: No position found for symbol={}'.format(symbol))
+        return position
+
+    def get_or_create_position(self, symbol):
+        """Return the position of the symbol, a new flat one tracked by the portfolio if there is none yet"""
+        position = self.positions.get(symbol)
+        if position is None:
+            position = Position(symbol)
+            self.positions.append(position)
+            self.portfolio.track(position)
+        return position
 
     def get_performance_by_symbol(self, symbol):
-        for performance in self.symbol_performances:
-            if performance.symbol == symbol:
-                return performance
-        logging.debug('xMan: get_performance_by_symbol: No position found for symbol={}'.format(symbol))
+        performance = self.symbol_performances.get(symbol)
+        if performance is None:
+            logging.debug('xMan: get_performance_by_symbol: No position found for symbol={}'.format(symbol))
+        return performance
 
     def execute_market_order(self, order, market_tick):
         """Execute market order, update position"""
@@ -74,10 +83,7 @@ class xMan:
             # Update limit / stop price of linked orders
             self.update_limit_stop_price_on_market_order_filled(order, market_tick.open)
 
-        position = self.get_position_by_symbol(order.symbol)
-        if not position:
-            position = Position(order.symbol)
-            self.positions.append(position)
+        position = self.get_or_create_position(order.symbol)
         position.change(market_tick.open, quantity_changed, order.commission)
 
     def execute_limit_order(self, order, market_tick):
@@ -91,10 +97,7 @@ class xMan:
             if order.state == ORDER_STATE_FULLY_FILLED:
                 self.cancel_linked_orders(order, market_tick.dt_idx)
 
-            position = self.get_position_by_symbol(order.symbol)
-            if not position:
-                position = Position(order.symbol)
-                self.positions.append(position)
+            position = self.get_or_create_position(order.symbol)
             position.change(order.price, quantity_changed, order.commission)
 
     def execute_stop_order(self, order, market_tick):
@@ -107,14 +110,11 @@ class xMan:
             if order.state == ORDER_STATE_FULLY_FILLED:
                 self.cancel_linked_orders(order, market_tick.dt_idx)
 
-            position = self.get_position_by_symbol(order.symbol)
-            if not position:
-                position = Position(order.symbol)
-                self.positions.append(position)
+            position = self.get_or_create_position(order.symbol)
             position.change(order.price, quantity_changed, order.commission)
 
     def execute_orders_on_market_tick(self, market_tick):
-        for order in self.get_orders_by_symbol(market_tick.symbol):
+        for order in self.orders.get_active_orders_by_symbol(market_tick.symbol):
             if order.valid_to_dt_idx is not None and market_tick.dt_idx > order.valid_to_dt_idx:
                 continue
             if order.valid_from_dt_idx is not None and market_tick.dt_idx < order.valid_from_dt_idx:
@@ -132,10 +132,7 @@ class xMan:
                 logging.error('xMan: execute_orders_on_market_tick: Unsupported order type {}'.format(order))
 
     def update_mtm_on_market_tick(self, market_tick):
-        position = self.get_position_by_symbol(market_tick.symbol)
-        if not position:
-            position = Position(market_tick.symbol)
-            self.positions.append(position)
+        position = self.get_or_create_position(market_tick.symbol)
         position.update_mtm(market_tick.close)
 
     def run_on_market_ticks(self, market_ticks_by_symbol):
@@ -152,12 +149,15 @@ class xMan:
             # Execute existing orders from previous tradingPeriod. In reality, this happens during current tradingPeriod.
             self.execute_orders_on_market_tick(market_tick)
             # Update Position and Portfolio MTM using Close price. In reality, this happens at end of current trading Period.
+            # Portfolio totals follow position changes incrementally.
             self.update_mtm_on_market_tick(market_tick)
-            # Refresh portfolio
-            self.portfolio.refresh(self.positions)
+
+        if self.check_consistency:
+            self.portfolio.verify(self.positions)
 
         # Record daily portfolio
-        self.historical_portfolios.append(copy.deepcopy(self.portfolio))
+        dt_idx = next(iter(market_ticks_by_symbol.values())).dt_idx if market_ticks_by_symbol else None
+        self.portfolio_history.append(self.portfolio, dt_idx)
 
     def update_limit_stop_price_on_market_order_filled(self, order, price):
         """ Update limit / stop price of linked orders """
@@ -178,55 +178,86 @@ class xMan:
     def link_orders(self, orders):
         """If one order get fully filled, other linked orders will be cancelled"""
         link_id = uuid.uuid4()
-        for order in orders:
-            order.link_id = link_id
+        self.orders.link(orders, link_id)
         logging.debug(
             'xMan: link_orders: Linked order_ids={}, link_id={}'.format([order.order_id for order in orders], link_id))
 
     def get_all_symbols(self):
         """Get all symbols ever executed"""
-        order_symbols = [order.symbol for order in self.orders]
-        position_symbols = [position.symbol for position in self.positions]
+        order_symbols = self.orders.get_all_symbols()
+        position_symbols = self.positions.symbols()
         return list(set(order_symbols + position_symbols))
 
+    def recount_order_statistics(self, symbol):
+        """Order counts and total trade life of a symbol walking all its orders, as evaluate_performance did"""
+        outstanding_market_orders, outstanding_stop_orders, outstanding_limit_orders, filled_market_orders, \
+        filled_stop_orders, filled_limit_orders, cancelled_market_orders, cancelled_stop_orders, \
+        cancelled_limit_orders = 0, 0, 0, 0, 0, 0, 0, 0, 0
+        total_trade_life = datetime.timedelta()
+        for order in self.get_orders_by_symbol(symbol):
+            if order.state in [ORDER_STATE_PARTIALLY_FILLED, ORDER_STATE_NEW]:
+                if order.type == ORDER_TYPE_MARKET:
+                    outstanding_market_orders += 1
+                elif order.type == ORDER_TYPE_STOP:
+                    outstanding_stop_orders += 1
+                elif order.type == ORDER_TYPE_LIMIT:
+                    outstanding_limit_orders += 1
+            elif order.state == ORDER_STATE_FULLY_FILLED:
+                if order.type == ORDER_TYPE_MARKET:
+                    filled_market_orders += 1
+                elif order.type == ORDER_TYPE_STOP:
+                    filled_stop_orders += 1
+                    total_trade_life += (order.close_dt_idx.to_pydatetime() - order.open_dt_idx.to_pydatetime())
+                elif order.type == ORDER_TYPE_LIMIT:
+                    filled_limit_orders += 1
+                    total_trade_life += (order.close_dt_idx.to_pydatetime() - order.open_dt_idx.to_pydatetime())
+            elif order.state == ORDER_STATE_CANCELLED:
+                if order.type == ORDER_TYPE_MARKET:
+                    cancelled_market_orders += 1
+                elif order.type == ORDER_TYPE_STOP:
+                    cancelled_stop_orders += 1
+                elif order.type == ORDER_TYPE_LIMIT:
+                    cancelled_limit_orders += 1
+        return {
+            ('outstanding', ORDER_TYPE_MARKET): outstanding_market_orders,
+            ('outstanding', ORDER_TYPE_STOP): outstanding_stop_orders,
+            ('outstanding', ORDER_TYPE_LIMIT): outstanding_limit_orders,
+            ('filled', ORDER_TYPE_MARKET): filled_market_orders,
+            ('filled', ORDER_TYPE_STOP): filled_stop_orders,
+            ('filled', ORDER_TYPE_LIMIT): filled_limit_orders,
+            ('cancelled', ORDER_TYPE_MARKET): cancelled_market_orders,
+            ('cancelled', ORDER_TYPE_STOP): cancelled_stop_orders,
+            ('cancelled', ORDER_TYPE_LIMIT): cancelled_limit_orders,
+        }, total_trade_life
+
+    def verify_order_statistics(self, statistics):
+        """Check the incremental order statistics of a symbol against a recount of all its orders"""
+        counts, total_trade_life = self.recount_order_statistics(statistics.symbol)
+        if counts != statistics.counts or total_trade_life != statistics.total_trade_life:
+            logging.error('xMan: verify_order_statistics: statistics={} but recount counts={}, total_trade_life={}'
+                          .format(statistics, counts, total_trade_life))
+            raise Exception()
+
     def evaluate_performance(self):
         self.portfolio_success = 0
         self.portfolio_failure = 0
         self.portfolio_total_trade_life = datetime.timedelta()
 
         for symbol in self.get_all_symbols():
-            outstanding_market_orders, outstanding_stop_orders, outstanding_limit_orders, filled_market_orders, \
-            filled_stop_orders, filled_limit_orders, cancelled_market_orders, cancelled_stop_orders, \
-            cancelled_limit_orders = 0, 0, 0, 0, 0, 0, 0, 0, 0
-            total_trade_life = datetime.timedelta()
-            for order in self.get_orders_by_symbol(symbol):
-                if order.state in [ORDER_STATE_PARTIALLY_FILLED, ORDER_STATE_NEW]:
-                    if order.type == ORDER_TYPE_MARKET:
-                        outstanding_market_orders += 1
-                    elif order.type == ORDER_TYPE_STOP:
-                        outstanding_stop_orders += 1
-                    elif order.type == ORDER_TYPE_LIMIT:
-                        outstanding_limit_orders += 1
-                elif order.state == ORDER_STATE_FULLY_FILLED:
-                    if order.type == ORDER_TYPE_MARKET:
-                        filled_market_orders += 1
-                    elif order.type == ORDER_TYPE_STOP:
-                        filled_stop_orders += 1
-                        total_trade_life += (order.close_dt_idx.to_pydatetime() - order.open_dt_idx.to_pydatetime())
-                    elif order.type == ORDER_TYPE_LIMIT:
-                        filled_limit_orders += 1
-                        total_trade_life += (order.close_dt_idx.to_pydatetime() - order.open_dt_idx.to_pydatetime())
-                elif order.state == ORDER_STATE_CANCELLED:
-                    if order.type == ORDER_TYPE_MARKET:
-                        cancelled_market_orders += 1
-                    elif order.type == ORDER_TYPE_STOP:
-                        cancelled_stop_orders += 1
-                    elif order.type == ORDER_TYPE_LIMIT:
-                        cancelled_limit_orders += 1
-            position = self.get_position_by_symbol(symbol)
-            if not position:
-                position = Position(symbol)
-                self.positions.append(position)
+            statistics = self.orders.get_statistics(symbol) or SymbolOrderStatistics(symbol)
+            if self.check_consistency:
+                self.verify_order_statistics(statistics)
+            outstanding_market_orders = statistics.get('outstanding', ORDER_TYPE_MARKET)
+            outstanding_stop_orders = statistics.get('outstanding', ORDER_TYPE_STOP)
+            outstanding_limit_orders = statistics.get('outstanding', ORDER_TYPE_LIMIT)
+            filled_market_orders = statistics.get('filled', ORDER_TYPE_MARKET)
+            filled_stop_orders = statistics.get('filled', ORDER_TYPE_STOP)
+            filled_limit_orders = statistics.get('filled', ORDER_TYPE_LIMIT)
+            cancelled_market_orders = statistics.get('cancelled', ORDER_TYPE_MARKET)
+            cancelled_stop_orders = statistics.get('cancelled', ORDER_TYPE_STOP)
+            cancelled_limit_orders = statistics.get('cancelled', ORDER_TYPE_LIMIT)
+            total_trade_life = statistics.total_trade_life
+            position = self.get_or_create_position(symbol)
             symbol_performance = self.get_performance_by_symbol(symbol)
             if not symbol_performance:
                 symbol_performance = Performance(symbol)
@@ -263,10 +294,9 @@ class xMan:
                 self.portfolio_success + self.portfolio_failure) if self.portfolio_success + self.portfolio_failure else float('nan')
         portfolio_avg_trade_life = self.portfolio_total_trade_life / (
                 self.portfolio_success + self.portfolio_failure) if self.portfolio_success + self.portfolio_failure > 0 else 'No Trades'
-        daily_portfolio = pandas.Series([p.position_mtm + p.cash_balance for p in self.historical_portfolios])
-        annual_return = annualized_return(daily_portfolio)
-        annual_vol = annualized_volatility(daily_portfolio)
-        sharpe = sharpe_ratio(daily_portfolio, risk_free=self.risk_free)
+        annual_return = self.portfolio_history.annualized_return()
+        annual_vol = self.portfolio_history.annualized_volatility()
+        sharpe = self.portfolio_history.sharpe_ratio(risk_free=self.risk_free)
 
         logging.info('xMan: evaluate_performance: Portfolio portfolio realized_pnl={}, portfolio cash_balance={}, '
                      'portfolio position_cost={}, portfolio position_mtm={}, portfolio_max_capital_required={}, '
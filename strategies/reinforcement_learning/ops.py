@@ -4,6 +4,9 @@ import logging
 import numpy as np
 import keras.backend as K
 from utils.data_hub import DataHub
+from utils.data_store import LocalDataStore
+
+DATA_STORE_DIR = 'data'
 
 format_quantity = lambda x: '{0:,}'.format(x)
 format_notional = lambda x: ('-$' if x < 0 else '+$') + '{0:15,.2f}'.format(abs(x))
@@ -56,14 +59,28 @@ def show_eval_result(result):
     logging.info('#############################')
 
 
-def get_stock_data(stock, start_date, end_date):
+_data_hub = None
+
+
+def get_data_hub():
+    """
+    DataHub shared by every get_stock_data call, backed by the local store so that adjusted panels persist across
+    train / validate / test and across runs
+    """
+    global _data_hub
+    if _data_hub is None:
+        _data_hub = DataHub(store=LocalDataStore(DATA_STORE_DIR))
+    return _data_hub
+
+
+def get_stock_data(stock, start_date, end_date, data_hub=None):
     """
-    Reads stock data from csv file
+    Reads the adjusted closes of stock, through data_hub or the shared one
     """
-    data_hub = DataHub()
-    dfs = data_hub.downloadDataFromYahoo(startDate=start_date, endDate=end_date, symbols=[stock])
-    df = dfs[stock]
-    return list(df['Adj Close'])
+    data_hub = data_hub if data_hub is not None else get_data_hub()
+    # Adjusted by the source's Adj Close when it has one, yfinance closes are already adjusted otherwise
+    panel = data_hub.getAdjustedMarketPanel(start_date, end_date, [stock], useAdjClose=True)
+    return list(panel.close[panel.valid[:, 0], 0])
 
 
 def switch_k_backend_device():
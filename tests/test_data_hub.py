@@ -0,0 +1,180 @@
+import datetime
+import threading
+import numpy as np
+import pandas
+import pytest
+from utils import data_hub as data_hub_module
+from utils.data_fetcher import CsvFetcher
+from utils.data_hub import DataHub
+from utils.data_store import LocalDataStore
+
+START_DATE = datetime.date(2020, 1, 1)
+END_DATE = datetime.date(2020, 3, 1)
+
+
+def write_csv(root, symbol, start_date=START_DATE, end_date=END_DATE):
+    dates = pandas.bdate_range(start_date, end_date, inclusive='left', name='Date')
+    close = pandas.Series(range(len(dates)), index=dates, dtype=float) + 100.0
+    df = pandas.DataFrame({'Open': close, 'High': close + 1.0, 'Low': close - 1.0, 'Close': close,
+                           'Volume': 1.0e6}, index=dates)
+    df.to_csv(root / '{}.csv'.format(symbol))
+
+
+class FlakyFetcher:
+    """CsvFetcher failing the first failures[symbol] calls of a symbol, with an exception or an empty frame"""
+    def __init__(self, root, failures, empty=False):
+        self.fetcher = CsvFetcher(str(root))
+        self.failures = dict(failures)
+        self.empty = empty
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fetch(self, symbol, startDate, endDate):
+        with self.lock:
+            self.calls.append((symbol, startDate, endDate))
+            failing = self.failures.get(symbol, 0) > 0
+            if failing:
+                self.failures[symbol] -= 1
+        if failing:
+            if self.empty:
+                return pandas.DataFrame()
+            raise ConnectionError('{} unavailable'.format(symbol))
+        return self.fetcher.fetch(symbol, startDate, endDate)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays asked by DataHub, without sleeping"""
+    delays = []
+    monkeypatch.setattr(data_hub_module.time, 'sleep', delays.append)
+    return delays
+
+
+@pytest.fixture
+def csv_root(tmp_path):
+    root = tmp_path / 'csv'
+    root.mkdir()
+    for symbol in ['AAA', 'BBB', 'CCC']:
+        write_csv(root, symbol)
+    return root
+
+
+def test_retries_with_exponential_backoff(csv_root, sleeps):
+    fetcher = FlakyFetcher(csv_root, {'AAA': 2})
+    data_hub = DataHub(fetcher=fetcher, retries=3, backoff=0.5)
+    symbol_data = data_hub.downloadDataFromYahoo(START_DATE, END_DATE, ['AAA'])
+
+    assert len(symbol_data['AAA']) == len(pandas.bdate_range(START_DATE, END_DATE, inclusive='left'))
+    assert sleeps == [0.5, 1.0]
+    assert data_hub.lastReport.attempts == {'AAA': 3}
+    assert data_hub.lastReport.succeeded == ['AAA']
+    assert data_hub.lastReport.failed == {}
+
+
+def test_failure_report_once_retries_run_out(csv_root, sleeps):
+    fetcher = FlakyFetcher(csv_root, {'AAA': 10})
+    data_hub = DataHub(fetcher=fetcher, retries=2, backoff=1.0)
+    symbol_data = data_hub.downloadDataFromYahoo(START_DATE, END_DATE, ['AAA'])
+
+    assert symbol_data == {}
+    assert sleeps == [1.0, 2.0]
+    assert len(fetcher.calls) == 3
+    assert data_hub.lastReport.attempts == {'AAA': 3}
+    assert data_hub.lastReport.succeeded == []
+    assert 'ConnectionError' in data_hub.lastReport.failed['AAA']
+
+
+def test_empty_frames_are_retried_and_reported(csv_root, sleeps):
+    fetcher = FlakyFetcher(csv_root, {'AAA': 10}, empty=True)
+    data_hub = DataHub(fetcher=fetcher, retries=1, backoff=1.0)
+    assert data_hub.downloadDataFromYahoo(START_DATE, END_DATE, ['AAA']) == {}
+    assert len(fetcher.calls) == 2
+    assert 'AAA' in data_hub.lastReport.failed
+
+
+def test_partial_failure_keeps_the_other_symbols(csv_root, sleeps):
+    fetcher = FlakyFetcher(csv_root, {'BBB': 10, 'CCC': 1})
+    data_hub = DataHub(fetcher=fetcher, maxWorkers=3, retries=1, backoff=1.0)
+    symbol_data = data_hub.downloadDataFromYahoo(START_DATE, END_DATE, ['AAA', 'BBB', 'CCC'])
+
+    assert sorted(symbol_data) == ['AAA', 'CCC']
+    assert sorted(data_hub.lastReport.succeeded) == ['AAA', 'CCC']
+    assert list(data_hub.lastReport.failed) == ['BBB']
+    assert data_hub.lastReport.attempts == {'AAA': 1, 'BBB': 2, 'CCC': 2}
+    # Each symbol gets its own bars
+    for symbol, df in symbol_data.items():
+        assert list(df.columns.get_level_values(1).unique()) == [symbol]
+
+
+def test_store_is_only_fetched_for_missing_ranges(csv_root, tmp_path, sleeps):
+    store = LocalDataStore(str(tmp_path / 'store'))
+    fetcher = FlakyFetcher(csv_root, {})
+    DataHub(store=store, fetcher=fetcher).downloadDataFromYahoo(START_DATE, datetime.date(2020, 2, 1), ['AAA'])
+    data_hub = DataHub(store=store, fetcher=fetcher)
+    symbol_data = data_hub.downloadDataFromYahoo(START_DATE, END_DATE, ['AAA'])
+
+    assert fetcher.calls == [('AAA', START_DATE, datetime.date(2020, 2, 1)),
+                             ('AAA', datetime.date(2020, 2, 1), END_DATE)]
+    assert len(symbol_data['AAA']) == len(pandas.bdate_range(START_DATE, END_DATE, inclusive='left'))
+
+
+def test_gaps_without_trading_days_are_not_fetched(csv_root, tmp_path, sleeps):
+    store = LocalDataStore(str(tmp_path / 'store'))
+    fetcher = FlakyFetcher(csv_root, {})
+    DataHub(store=store, fetcher=fetcher).downloadDataFromYahoo(START_DATE, datetime.date(2020, 2, 8), ['AAA'])
+    calls = len(fetcher.calls)
+
+    # Saturday to Monday, nothing to fetch, on this run or later ones
+    for _ in range(2):
+        data_hub = DataHub(store=store, fetcher=fetcher)
+        symbol_data = data_hub.downloadDataFromYahoo(START_DATE, datetime.date(2020, 2, 10), ['AAA'])
+        assert len(fetcher.calls) == calls
+        assert sleeps == []
+        assert data_hub.lastReport.failed == {}
+        assert data_hub.lastReport.succeeded == ['AAA']
+        assert symbol_data['AAA'].index[-1] == pandas.Timestamp('2020-02-07')
+    assert store.getMissingRanges('AAA', START_DATE, datetime.date(2020, 2, 10)) == []
+
+
+def test_empty_downloads_are_not_stored(csv_root, tmp_path, sleeps):
+    store = LocalDataStore(str(tmp_path / 'store'))
+    DataHub(store=store, fetcher=FlakyFetcher(csv_root, {'AAA': 1}, empty=True), retries=0) \
+        .downloadDataFromYahoo(START_DATE, END_DATE, ['AAA'])
+    assert store.getCoverage('AAA') == []
+
+    data_hub = DataHub(store=store, fetcher=FlakyFetcher(csv_root, {}))
+    symbol_data = data_hub.downloadDataFromYahoo(START_DATE, END_DATE, ['AAA'])
+    assert len(symbol_data['AAA']) == len(pandas.bdate_range(START_DATE, END_DATE, inclusive='left'))
+
+
+def test_coverage_stops_before_today(csv_root, tmp_path, sleeps):
+    today = datetime.date.today()
+    write_csv(csv_root, 'AAA', today - datetime.timedelta(days=30), today + datetime.timedelta(days=1))
+    store = LocalDataStore(str(tmp_path / 'store'))
+    DataHub(store=store, fetcher=FlakyFetcher(csv_root, {})).downloadDataFromYahoo(
+        today - datetime.timedelta(days=30), today + datetime.timedelta(days=10), ['AAA'])
+    assert store.getCoverage('AAA')[-1][1] <= today
+
+
+def test_adjusted_panels_persist_in_the_store(csv_root, tmp_path, sleeps):
+    store = LocalDataStore(str(tmp_path / 'store'))
+    fetcher = FlakyFetcher(csv_root, {})
+    expected = DataHub(store=store, fetcher=fetcher).getAdjustedMarketPanel(START_DATE, END_DATE, ['AAA', 'BBB'],
+                                                                            fillLimit=1)
+    fetched = len(fetcher.calls)
+
+    # A new DataHub on the same store, e.g. the next get_stock_data or run, reads the adjusted panel back
+    data_hub = DataHub(store=store, fetcher=fetcher, offline=True)
+    data_hub.getMarketPanel = None
+    actual = data_hub.getAdjustedMarketPanel(START_DATE, END_DATE, ['AAA', 'BBB'], fillLimit=1)
+    assert len(fetcher.calls) == fetched
+    assert actual.symbols == expected.symbols
+    assert actual.dates.equals(expected.dates)
+    for field in ['open', 'high', 'low', 'close', 'volume', 'close_return', 'valid', 'adj_close', 'provenance',
+                  'adjustment']:
+        np.testing.assert_array_equal(getattr(actual, field), getattr(expected, field))
+    assert data_hub.getAdjustedMarketPanel(START_DATE, END_DATE, ['AAA', 'BBB'], fillLimit=1) is actual
+
+    # Other cleansing options are another panel
+    other = DataHub(store=store, fetcher=fetcher).getAdjustedMarketPanel(START_DATE, END_DATE, ['AAA', 'BBB'])
+    assert other is not actual
@@ -0,0 +1,73 @@
+import datetime
+import numpy as np
+import pandas
+from utils.data_hub import DataHub
+from utils.data_store import LocalDataStore
+from utils.intraday import ticksToBars
+
+
+def write_ticks(path, rows):
+    df = pandas.DataFrame(rows, columns=['Date', 'Price', 'Size']).set_index('Date')
+    df.to_csv(path)
+    return str(path)
+
+
+def test_ticks_sharing_a_timestamp_are_all_kept(tmp_path):
+    path = write_ticks(tmp_path / 'ticks.csv', [
+        ('2020-01-02 09:30:00', 10.0, 100.0),
+        ('2020-01-02 09:30:00', 11.0, 200.0),
+        ('2020-01-02 09:30:00', 12.0, 300.0),
+        ('2020-01-02 09:31:00', 13.0, 400.0),
+    ])
+    data_hub = DataHub(intradayStore=LocalDataStore(str(tmp_path / 'intraday')))
+    assert data_hub.ingestIntraday('AAA', path) == 4
+
+    bars = data_hub.getIntradayBars(datetime.date(2020, 1, 2), datetime.date(2020, 1, 3), ['AAA'], '5min')['AAA']
+    assert len(bars) == 1
+    bar = bars.iloc[0]
+    assert bar[('Open', 'AAA')] == 10.0
+    assert bar[('High', 'AAA')] == 13.0
+    assert bar[('Low', 'AAA')] == 10.0
+    assert bar[('Close', 'AAA')] == 13.0
+    assert bar[('Volume', 'AAA')] == 1000.0
+
+
+def test_reingest_replaces_the_covered_range(tmp_path):
+    store = LocalDataStore(str(tmp_path / 'intraday'))
+    data_hub = DataHub(intradayStore=store)
+    first = write_ticks(tmp_path / 'first.csv', [
+        ('2020-01-02 09:30:00', 10.0, 100.0),
+        ('2020-01-02 09:30:00', 11.0, 200.0),
+        ('2020-01-03 09:30:00', 20.0, 100.0),
+    ])
+    data_hub.ingestIntraday('AAA', first)
+    # Same day again, corrected, both trades still at the same timestamp
+    second = write_ticks(tmp_path / 'second.csv', [
+        ('2020-01-02 09:30:00', 10.5, 100.0),
+        ('2020-01-02 09:30:00', 11.5, 300.0),
+    ])
+    data_hub.ingestIntraday('AAA', second)
+
+    times, data = store.readArrays('AAA', None, None)
+    np.testing.assert_array_equal(data['Price'], [10.5, 11.5, 20.0])
+    np.testing.assert_array_equal(data['Size'], [100.0, 300.0, 100.0])
+    assert times[0] == times[1]
+
+
+def test_ticks_to_bars_matches_pandas_resample():
+    rng = np.random.default_rng(0)
+    first = pandas.Timestamp('2020-01-02 09:31:17').value
+    times = first + np.sort(rng.integers(0, 5 * 24 * 3600 * 10 ** 9, 20000))
+    # Repeated timestamps, as trades printed together
+    times[1::7] = times[0::7][:times[1::7].size]
+    prices = 100.0 + np.cumsum(rng.normal(0.0, 0.01, times.size))
+    sizes = rng.integers(1, 1000, times.size).astype(np.float64)
+    series = pandas.Series(prices, index=pandas.DatetimeIndex(times.astype('datetime64[ns]')))
+    for bar_size in ['1min', '7min', '1h', '1D']:
+        labels, bars = ticksToBars(times, prices, sizes, bar_size)
+        expected = series.resample(bar_size).ohlc().dropna()
+        volume = pandas.Series(sizes, index=series.index).resample(bar_size).sum()
+        np.testing.assert_array_equal(labels, expected.index.values.astype(np.int64))
+        for column in ['open', 'high', 'low', 'close']:
+            np.testing.assert_array_equal(bars[column.capitalize()], expected[column].to_numpy())
+        np.testing.assert_array_equal(bars['Volume'], volume[volume > 0].to_numpy())
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas
+import pytest
+from utils.market_panel import MarketPanel
+from utils.market_replay import MarketReplay
+from utils.trading_calendar import TradingCalendar
+from strategies.magi.config import Config
+from strategies.magi.magi import Magi
+from strategies.magi.signals import MODEL_SERIES, new_signal_windows, precompute_signals
+from strategies.magi.x_man import xMan
+
+CAPITAL = 10000
+SYMBOLS = ['AAA', 'BBB', 'CCC']
+
+
+def market_panel(seed=0, days=1000):
+    """Random walk daily bars, with a missing stretch for one symbol so its ticks and the panel rows differ"""
+    rng = np.random.default_rng(seed)
+    dates = pandas.bdate_range('2015-01-01', periods=days, name='Date')
+    symbol_data = dict()
+    for symbol in SYMBOLS:
+        close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.02, days)))
+        df = pandas.DataFrame({
+            'Open': close * (1.0 + rng.normal(0.0, 0.01, days)),
+            'High': close * 1.02,
+            'Low': close * 0.98,
+            'Close': close,
+            'Volume': np.full(days, 1.0e6),
+        }, index=dates)
+        if symbol == 'BBB':
+            df = df.drop(dates[300:320])
+        symbol_data[symbol] = df
+    return MarketPanel.fromSymbolData(symbol_data, dates)
+
+
+def backtest(panel, model_name, precompute):
+    """Daily flow of run.execute: xMan executes and marks to market, then Magi runs the strategy"""
+    # Stop 2 days short of the calendar, mispricing closes its trades 2 trading days later
+    replay = MarketReplay(panel, endDate=panel.dates[-3])
+    x_man = xMan(CAPITAL, 0.01, check_consistency=True)
+    # Stop / limit prices from the signal metrics rather than fixed percentages, so any signal drift shows in orders
+    config = Config(symbols=list(SYMBOLS), trigger_distance=1.5, stop_order_pct=None, limit_order_pct=None)
+    signals = precompute_signals(panel, config, model_name) if precompute else None
+    magi = Magi(CAPITAL, x_man, config, TradingCalendar(panel.dates), model_name, signals)
+    for dt_idx, market_ticks_by_symbol in replay:
+        x_man.run_on_market_ticks(market_ticks_by_symbol)
+        x_man.evaluate_performance()
+        magi.run_on_market_ticks(market_ticks_by_symbol)
+    return x_man
+
+
+# precompute_signals gives ma_long / sd to about 1e-12 relative of the tick by tick RollingWindow values, stop /
+# limit prices and what follows from their fills may differ that much, every other field must be equal
+PRICE_TOLERANCE = 1e-9
+
+
+def assert_same(actual, expected, fields):
+    for field in fields:
+        actual_value, expected_value = getattr(actual, field), getattr(expected, field)
+        if isinstance(expected_value, float):
+            expected_value = pytest.approx(expected_value, rel=PRICE_TOLERANCE, abs=PRICE_TOLERANCE, nan_ok=True)
+            assert actual_value == expected_value, field
+        else:
+            assert actual_value == expected_value, field
+
+
+def assert_same_items(actual, expected):
+    actual, expected = list(actual), list(expected)
+    assert len(actual) == len(expected)
+    for actual_item, expected_item in zip(actual, expected):
+        # uuid ids differ from run to run
+        assert_same(actual_item, expected_item,
+                    [field for field in vars(expected_item) if field not in ['order_id', 'link_id', 'observers']])
+
+
+@pytest.mark.parametrize('model_name', ['price_mean_reversion', 'focus_stock'])
+def test_precomputed_triggers_match_tick_by_tick(model_name):
+    panel = market_panel()
+    config = Config(symbols=list(SYMBOLS), trigger_distance=1.5)
+    signals = precompute_signals(panel, config, model_name)
+    values = getattr(panel, MODEL_SERIES[model_name])
+    start_index = max(config.sd_period, config.look_back_period, config.ma_short_period, config.ma_long_period)
+
+    trigger = np.zeros(panel.close.shape, dtype=bool)
+    for j in range(len(panel.symbols)):
+        windows = new_signal_windows(config)
+        for ticks, i in enumerate(np.flatnonzero(panel.valid[:, j]), 1):
+            value = float(values[i, j])
+            for window in windows.values():
+                window.append(value)
+            if ticks < start_index + 1:
+                assert np.isnan(signals.sd[i, j])
+                continue
+            sd = windows[config.sd_period].std()
+            ma_long = windows[config.ma_long_period].mean()
+            trigger[i, j] = value < ma_long - sd * config.trigger_distance
+            assert signals.highest[i, j] == windows[config.look_back_period].max()
+            assert signals.lowest[i, j] == windows[config.look_back_period].min()
+            assert signals.sd[i, j] == pytest.approx(sd, rel=1e-11)
+            assert signals.ma_long[i, j] == pytest.approx(ma_long, rel=1e-11, abs=1e-15)
+
+    assert np.count_nonzero(trigger) > 0
+    np.testing.assert_array_equal(signals.trigger, trigger)
+
+
+@pytest.mark.parametrize('model_name', ['price_mean_reversion', 'focus_stock'])
+def test_precomputed_signals_match_tick_by_tick(model_name):
+    panel = market_panel()
+    tick_by_tick = backtest(panel, model_name, precompute=False)
+    precomputed = backtest(panel, model_name, precompute=True)
+
+    assert len(tick_by_tick.orders) > 0
+    assert_same_items(precomputed.orders, tick_by_tick.orders)
+    assert_same_items(precomputed.positions, tick_by_tick.positions)
+    assert_same_items(precomputed.symbol_performances, tick_by_tick.symbol_performances)
+    assert_same(precomputed.portfolio, tick_by_tick.portfolio,
+                ['cash_balance', 'position_mtm', 'position_cost', 'realized_pnl'])
@@ -0,0 +1,18 @@
+import pytest
+from option_pricer import EuropeanVanillaPricer
+
+
+@pytest.mark.parametrize('iterations, chunkSize, workers', [(1001, 100, 1), (1001, 1000, 1), (1, 100, 1),
+                                                            (2003, 99, 2)])
+def test_antithetic_paths_used_never_exceed_iterations(iterations, chunkSize, workers):
+    pricer = EuropeanVanillaPricer(iterations=iterations, chunkSize=chunkSize, varianceReduction='antithetic',
+                                   seed=0, workers=workers, executor='thread')
+    pricer.getPrice()
+    assert pricer.pathsUsed == iterations
+
+
+def test_antithetic_odd_iterations_price():
+    bs = EuropeanVanillaPricer(method='BS', strike=100.0).getPrice()
+    pricer = EuropeanVanillaPricer(strike=100.0, iterations=100001, chunkSize=9999, varianceReduction='antithetic',
+                                   seed=1)
+    assert abs(pricer.getPrice() - bs) < 4.0 * pricer.standardError
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas
+import pytest
+from utils.rolling_window import RollingWindow
+from strategies.magi.config import SD_PERIOD, LOOK_BACK_PERIOD, MA_SHORT_PERIOD, MA_LONG_PERIOD, TRIGGER_DISTANCE
+
+PERIODS = sorted({SD_PERIOD, LOOK_BACK_PERIOD, MA_SHORT_PERIOD, MA_LONG_PERIOD})
+
+
+def magi_pandas_metrics(values, period):
+    """
+    Metrics as Magi computed them before rolling windows: the symbol's ticks are concatenated into a pandas Series
+    indexed by date, and each tick reads ts[:dt_idx][-period:]
+    """
+    dates = pandas.bdate_range('2015-01-01', periods=len(values))
+    ts = None
+    metrics = []
+    for dt_idx, value in zip(dates, values):
+        tick = pandas.Series(data=[value], index=[dt_idx])
+        ts = tick if ts is None else pandas.concat([ts, tick])
+        window = ts[:dt_idx][-period:]
+        metrics.append((window.mean(), window.std(), window.max(), window.min()))
+    return np.array(metrics)
+
+
+def rolling_window_metrics(values, period):
+    window = RollingWindow(period)
+    metrics = []
+    for value in values:
+        window.append(value)
+        metrics.append((window.mean(), window.std(), window.max(), window.min()))
+    return np.array(metrics)
+
+
+def tolerances(values, period):
+    """
+    Both sides sum the same window values, in a different order: pandas once per tick, RollingWindow by add /
+    remove updates recomputed every period. Each sum is off by at most about period roundings of its largest term,
+    which bounds the mean by period * eps * max|value| and the variance by period * eps * max|value| ** 2. The std
+    is checked through the variance, the square root would blow that bound up as the std goes to 0.
+    """
+    scale = np.nanmax(np.abs(values))
+    eps = np.finfo(np.float64).eps
+    return period * eps * scale, period * eps * scale ** 2
+
+
+def assert_matches_magi_pandas(values, period):
+    expected = magi_pandas_metrics(values, period)
+    actual = rolling_window_metrics(values, period)
+    # max / min pick values, they must be exactly equal
+    np.testing.assert_array_equal(actual[:, 2:], expected[:, 2:])
+    mean_tolerance, variance_tolerance = tolerances(values, period)
+    np.testing.assert_allclose(actual[:, 0], expected[:, 0], rtol=0, atol=mean_tolerance)
+    np.testing.assert_allclose(actual[:, 1] ** 2, expected[:, 1] ** 2, rtol=0, atol=variance_tolerance)
+
+
+def close_returns(days=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0, 0.02, days)
+    # First return of a symbol is NaN, as out of pct_change
+    returns[0] = np.nan
+    return returns
+
+
+@pytest.mark.parametrize('period', PERIODS + [1, 2])
+def test_closes(period):
+    rng = np.random.default_rng(period)
+    closes = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.02, 1000)))
+    assert_matches_magi_pandas(closes, period)
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_close_returns(period):
+    assert_matches_magi_pandas(close_returns(seed=period), period)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_mispricing_triggers(seed):
+    """focus_stock triggers on close returns, curr_return < ma_long - sd * trigger_distance, must be identical"""
+    returns = close_returns(seed=seed)
+    start_index = max(PERIODS)
+    expected_sd = magi_pandas_metrics(returns, SD_PERIOD)[:, 1]
+    expected_ma_long = magi_pandas_metrics(returns, MA_LONG_PERIOD)[:, 0]
+    actual_sd = rolling_window_metrics(returns, SD_PERIOD)[:, 1]
+    actual_ma_long = rolling_window_metrics(returns, MA_LONG_PERIOD)[:, 0]
+    # Lower the distance so that the series triggers often
+    distance = TRIGGER_DISTANCE / 2.0
+
+    expected = returns[start_index:] < expected_ma_long[start_index:] - expected_sd[start_index:] * distance
+    actual = returns[start_index:] < actual_ma_long[start_index:] - actual_sd[start_index:] * distance
+    assert np.count_nonzero(expected) > 0
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_warm_up():
+    period = 10
+    values = np.arange(1.0, 6.0)
+    actual = rolling_window_metrics(values, period)
+    np.testing.assert_array_equal(actual[:, 0], [1.0, 1.5, 2.0, 2.5, 3.0])
+    # A single value has no sample standard deviation
+    assert np.isnan(actual[0, 1])
+    np.testing.assert_array_equal(actual[:, 2], values)
+    np.testing.assert_array_equal(actual[:, 3], np.ones(5))
+    assert_matches_magi_pandas(values, period)
+
+
+def test_constant_prices_have_zero_variance():
+    period = 20
+    values = np.full(200, 101.37)
+    actual = rolling_window_metrics(values, period)
+    assert np.all(actual[1:, 1] == 0.0)
+    np.testing.assert_array_equal(actual[:, 0], values)
+    assert_matches_magi_pandas(values, period)
+
+
+def test_constant_prices_after_moves():
+    # The variance must come back to zero once the window is flat again, not stay at a rounding residue
+    period = 20
+    rng = np.random.default_rng(1)
+    values = np.r_[100.0 + rng.normal(0.0, 5.0, 50), np.full(100, 97.5)]
+    actual = rolling_window_metrics(values, period)
+    assert np.all(actual[-(100 - period):, 1] ** 2 <= tolerances(values, period)[1])
+    assert_matches_magi_pandas(values, period)
+
+
+def test_nan_gaps():
+    period = 5
+    values = np.array([1.0, np.nan, 3.0, np.nan, np.nan, np.nan, np.nan, np.nan, 2.0, 4.0, np.nan, 6.0])
+    actual = rolling_window_metrics(values, period)
+    # Window of NaN only
+    assert np.all(np.isnan(actual[7]))
+    assert_matches_magi_pandas(values, period)
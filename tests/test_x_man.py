@@ -0,0 +1,79 @@
+import datetime
+import pandas
+import pytest
+from utils.order import Order, ORDER_TYPE_MARKET, ORDER_TYPE_LIMIT, ORDER_TYPE_STOP, ORDER_DIRECTION_BUY, \
+    ORDER_DIRECTION_SELL
+from strategies.magi.x_man import xMan
+
+DAY = pandas.Timestamp('2020-01-02')
+
+
+def day(n):
+    return DAY + pandas.Timedelta(days=n)
+
+
+def place(x_man, symbol, type, quantity=10, open_day=0):
+    direction = ORDER_DIRECTION_BUY if type == ORDER_TYPE_MARKET else ORDER_DIRECTION_SELL
+    order = Order(symbol, direction, type, 100.0, quantity, day(open_day))
+    x_man.place_order(order)
+    return order
+
+
+def assert_statistics_match_recount(x_man, symbol):
+    statistics = x_man.orders.get_statistics(symbol)
+    counts, total_trade_life = x_man.recount_order_statistics(symbol)
+    assert statistics.counts == counts
+    assert statistics.total_trade_life == total_trade_life
+    return counts, total_trade_life
+
+
+def test_statistics_follow_partial_fills_and_cancels():
+    x_man = xMan(10000, 0.0, check_consistency=True)
+    market = place(x_man, 'AAA', ORDER_TYPE_MARKET)
+    stop = place(x_man, 'AAA', ORDER_TYPE_STOP)
+    limit = place(x_man, 'AAA', ORDER_TYPE_LIMIT, open_day=1)
+    partial_limit = place(x_man, 'AAA', ORDER_TYPE_LIMIT)
+    other = place(x_man, 'BBB', ORDER_TYPE_STOP)
+    assert_statistics_match_recount(x_man, 'AAA')
+
+    # NEW -> PARTIALLY_FILLED stays outstanding
+    market.fill(100.0, 4, day(1))
+    limit.fill(101.0, 3, day(2))
+    partial_limit.fill(101.0, 5, day(2))
+    counts, _ = assert_statistics_match_recount(x_man, 'AAA')
+    assert counts[('outstanding', ORDER_TYPE_MARKET)] == 1
+    assert counts[('outstanding', ORDER_TYPE_LIMIT)] == 2
+
+    # PARTIALLY_FILLED -> FULLY_FILLED, trade life counted for stop / limit only
+    market.fill(100.0, 6, day(1))
+    limit.fill(102.0, 7, day(5))
+    stop.fill(99.0, 10, day(3))
+    # PARTIALLY_FILLED -> CANCELLED, NEW -> CANCELLED
+    partial_limit.cancel(day(4))
+    other.cancel(day(4))
+
+    counts, total_trade_life = assert_statistics_match_recount(x_man, 'AAA')
+    assert counts[('filled', ORDER_TYPE_MARKET)] == 1
+    assert counts[('filled', ORDER_TYPE_STOP)] == 1
+    assert counts[('filled', ORDER_TYPE_LIMIT)] == 1
+    assert counts[('cancelled', ORDER_TYPE_LIMIT)] == 1
+    assert counts[('outstanding', ORDER_TYPE_LIMIT)] == 0
+    assert total_trade_life == datetime.timedelta(days=3) + datetime.timedelta(days=4)
+    counts, _ = assert_statistics_match_recount(x_man, 'BBB')
+    assert counts[('cancelled', ORDER_TYPE_STOP)] == 1
+
+    x_man.evaluate_performance()
+    performance = x_man.get_performance_by_symbol('AAA')
+    assert performance.filled_limit_orders == 1
+    assert performance.cancelled_limit_orders == 1
+    assert performance.total_trade_life == datetime.timedelta(days=7)
+
+
+def test_consistency_check_catches_drift():
+    x_man = xMan(10000, 0.0, check_consistency=True)
+    order = place(x_man, 'AAA', ORDER_TYPE_STOP)
+    # A state change the book is not told about
+    order.observers.clear()
+    order.cancel(day(1))
+    with pytest.raises(Exception):
+        x_man.evaluate_performance()
@@ -4,10 +4,248 @@ Copyright:      2018 xiaokang.guan All rights reserved.
 Description:    Binomial Tree model utility functions.
 """
 
+import time
 import numpy as np
+from scipy.stats import binom
+from utils.black_scholes import blackScholesOptionPrice, blackScholesBatch
 
 
-def binomialTree(callPut, spot, strike, rate, sigma, tenor, N=2000, american=True):
+def binomialTree(callPut, spot, strike, rate, sigma, tenor, N=2000, american=True, earlyExit=False, scheme='CRR'):
+    """
+    Price an option on a binomial tree.
+    Leaves are built as a geometric sequence and backward induction reuses preallocated buffers in place.
+    earlyExit: for american options, stop checking early exercise as soon as no node of a time step is exercised.
+    Going backward in time the exercise boundary moves away from the lattice, so the remaining steps are European
+    and collapse into a single binomial-weighted sum.
+    scheme: 'CRR' Cox-Ross-Rubinstein, 'LR' Leisen-Reimer (N is bumped to the next odd number),
+    'BBS' CRR with Black-Scholes prices at the last step, 'Trinomial' trinomial lattice,
+    'CRR-RE-CV' BBS with Richardson extrapolation on N / 2 and N steps plus the Black-Scholes European price as
+    control variate. LR and CRR-RE-CV reach the accuracy of a 2000 step CRR tree with 100 - 200 steps.
+    """
+    if scheme == 'Trinomial':
+        return trinomialTree(callPut, spot, strike, rate, sigma, tenor, N=N, american=american)
+    if scheme == 'CRR-RE-CV':
+        return richardsonControlVariateTree(callPut, spot, strike, rate, sigma, tenor, N=N, american=american)
+
+    # Each time step period
+    u, d, p, N = _latticeParameters(scheme, spot, strike, rate, sigma, tenor, N)
+    deltaT = float(tenor) / N
+    discount = np.exp(-rate * deltaT)
+    pDiscounted = p * discount
+    oneMinusPDiscounted = (1.0 - p) * discount
+    # Node j of step i has stock spot * u ** j * d ** (i - j), i.e. node j of step i + 1 divided by d
+    stepBack = 1.0 / d
+    # Call payoff is stock - strike, put payoff is strike - stock
+    sign = 1.0 if callPut == 'Call' else -1.0
+    # BBS replaces the last step of the tree by Black-Scholes prices, so the induction starts one step earlier
+    last = N - 1 if scheme == 'BBS' else N
+
+    # Stock prices at the starting step, spot * u ** j * d ** (last - j)
+    stock = spot * u ** np.arange(last + 1, dtype=float) * d ** np.arange(last, -1, -1, dtype=float)
+
+    # Compute the Binomial Tree leaves, f_{N, j}
+    fs = np.empty(last + 1)
+    if scheme == 'BBS':
+        fs[:] = blackScholesBatch(sign > 0, stock, strike, deltaT, rate, sigma)['price']
+        if american:
+            np.maximum(fs, sign * (stock - strike), out=fs)
+    else:
+        np.subtract(stock, strike, out=fs)
+        fs *= sign
+        np.maximum(fs, 0.0, out=fs)
+
+    # Buffers reused across backward steps
+    continuation = np.empty(last)
+    exercise = np.empty(last)
+
+    # Calculate backward the option prices, at step i only nodes 0..i are alive
+    for i in range(last - 1, -1, -1):
+        alive = slice(0, i + 1)
+        np.multiply(fs[1:i + 2], pDiscounted, out=continuation[alive])
+        fs[alive] *= oneMinusPDiscounted
+        fs[alive] += continuation[alive]
+
+        if american:
+            stock[alive] *= stepBack
+            # Simply check if the option is worth more alive or dead
+            np.subtract(stock[alive], strike, out=exercise[alive])
+            exercise[alive] *= sign
+            # The exercise region sits at the bottom of the step for puts and at the top for calls
+            edge = i if sign > 0 else 0
+            if earlyExit and exercise[edge] <= fs[edge]:
+                return _europeanRollback(fs[:i + 1], p, discount)
+            np.maximum(fs[alive], exercise[alive], out=fs[alive])
+
+    return fs[0]
+
+
+def binomialTreeBatch(callPut, spot, strike, rate, sigma, tenor, N=2000, american=True, earlyExit=False, scheme='CRR'):
+    """
+    Price M contracts sharing tenor and N in one lattice sweep, backward induction runs on one (N+1, M) array.
+    callPut is a boolean mask (True for Call) or 'Call' / 'Put' labels, spot / strike / rate / sigma are arrays
+    of length M or scalars broadcast against them. Each contract has its own u, d and p.
+    earlyExit behaves as in binomialTree, the rollback switches to European once no contract exercises anymore.
+    scheme is 'CRR' or 'LR', see binomialTree.
+    Return an array of M prices.
+    """
+    if scheme not in ('CRR', 'LR'):
+        raise ValueError('Unsupported lattice scheme={} for binomialTreeBatch'.format(scheme))
+    callPut = np.asarray(callPut)
+    isCall = callPut if callPut.dtype == bool else callPut == 'Call'
+    isCall, spot, strike, rate, sigma = np.broadcast_arrays(
+        isCall, *[np.asarray(x, dtype=float) for x in (spot, strike, rate, sigma)])
+    isCall, spot, strike, rate, sigma = [np.atleast_1d(x) for x in (isCall, spot, strike, rate, sigma)]
+    M = spot.size
+
+    # Each time step period. The lattice is stored node-major, shape (N+1, M), so that the alive nodes of a step
+    # are one contiguous block, and the per-contract parameters broadcast along the last axis.
+    u, d, p, N = _latticeParameters(scheme, spot, strike, rate, sigma, tenor, N)
+    deltaT = float(tenor) / N
+    discount = np.exp(-rate * deltaT)
+    pDiscounted = p * discount
+    oneMinusPDiscounted = (1.0 - p) * discount
+    stepBack = 1.0 / d
+    sign = np.where(isCall, 1.0, -1.0)
+
+    # Stock prices at the leaves, one column per contract
+    stock = spot * u ** np.arange(N + 1, dtype=float)[:, None] * d ** np.arange(N, -1, -1, dtype=float)[:, None]
+
+    # Compute the Binomial Tree leaves, f_{N, j}
+    fs = np.empty((N + 1, M))
+    np.subtract(stock, strike, out=fs)
+    fs *= sign
+    np.maximum(fs, 0.0, out=fs)
+
+    # Buffers reused across backward steps
+    continuation = np.empty((N, M))
+    exercise = np.empty((N, M))
+    columns = np.arange(M)
+
+    # Calculate backward the option prices, at step i only nodes 0..i are alive
+    for i in range(N - 1, -1, -1):
+        np.multiply(fs[1:i + 2], pDiscounted, out=continuation[:i + 1])
+        fs[:i + 1] *= oneMinusPDiscounted
+        fs[:i + 1] += continuation[:i + 1]
+
+        if american:
+            stock[:i + 1] *= stepBack
+            np.subtract(stock[:i + 1], strike, out=exercise[:i + 1])
+            exercise[:i + 1] *= sign
+            edge = np.where(isCall, i, 0)
+            if earlyExit and np.all(exercise[edge, columns] <= fs[edge, columns]):
+                return _europeanRollbackBatch(fs[:i + 1], p, discount)
+            np.maximum(fs[:i + 1], exercise[:i + 1], out=fs[:i + 1])
+
+    return fs[0].copy()
+
+
+def trinomialTree(callPut, spot, strike, rate, sigma, tenor, N=200, american=True):
+    """
+    Price an option on a trinomial lattice, with u = exp(sigma * sqrt(3 * deltaT)) and the middle branch
+    probability 2/3. Node k of step i has stock spot * u ** (k - i), which is a view into the leaf stock array,
+    so only the option values are rolled back.
+    """
+    deltaT = float(tenor) / N
+    u = np.exp(sigma * np.sqrt(3.0 * deltaT))
+    drift = np.sqrt(deltaT / (12.0 * sigma ** 2)) * (rate - 0.5 * sigma ** 2)
+    discount = np.exp(-rate * deltaT)
+    pUpDiscounted = (1.0 / 6.0 + drift) * discount
+    pMiddleDiscounted = 2.0 / 3.0 * discount
+    pDownDiscounted = (1.0 / 6.0 - drift) * discount
+    sign = 1.0 if callPut == 'Call' else -1.0
+
+    # Stock prices at the leaves, spot * u ** (k - N) for k in 0..2N
+    stock = spot * u ** np.arange(-N, N + 1, dtype=float)
+
+    fs = np.empty(2 * N + 1)
+    np.subtract(stock, strike, out=fs)
+    fs *= sign
+    np.maximum(fs, 0.0, out=fs)
+
+    # Buffers reused across backward steps
+    continuation = np.empty(2 * N)
+    exercise = np.empty(2 * N)
+
+    # Calculate backward the option prices, at step i only nodes 0..2i are alive
+    for i in range(N - 1, -1, -1):
+        width = 2 * i + 1
+        np.multiply(fs[1:width + 1], pMiddleDiscounted, out=continuation[:width])
+        np.multiply(fs[2:width + 2], pUpDiscounted, out=exercise[:width])
+        continuation[:width] += exercise[:width]
+        fs[:width] *= pDownDiscounted
+        fs[:width] += continuation[:width]
+
+        if american:
+            np.subtract(stock[N - i:N + i + 1], strike, out=exercise[:width])
+            exercise[:width] *= sign
+            np.maximum(fs[:width], exercise[:width], out=fs[:width])
+
+    return fs[0]
+
+
+def richardsonControlVariateTree(callPut, spot, strike, rate, sigma, tenor, N=200, american=True):
+    """
+    CRR with two-point Richardson extrapolation and the Black-Scholes price as control variate.
+    The last step uses Black-Scholes prices (BBS), which removes the odd-even oscillation of plain CRR.
+    On each of N / 2 and N steps, the tree's European pricing error is removed from its American price,
+    then the two corrected prices are extrapolated assuming the error is O(1 / N). N is rounded up to even.
+    """
+    N = N + N % 2
+    corrected = []
+    for steps in (N // 2, N):
+        treePrice = binomialTree(callPut, spot, strike, rate, sigma, tenor, N=steps, american=american, scheme='BBS')
+        europeanPrice = treePrice if not american else \
+            binomialTree(callPut, spot, strike, rate, sigma, tenor, N=steps, american=False, scheme='BBS')
+        corrected.append(treePrice - europeanPrice)
+    return blackScholesOptionPrice(callPut, spot, strike, tenor, rate, sigma) + 2.0 * corrected[1] - corrected[0]
+
+
+def _peizerPratt(z, n):
+    """Peizer-Pratt method 2 inversion, mapping a normal deviate z to a binomial probability on n steps"""
+    return 0.5 + np.sign(z) * 0.5 * np.sqrt(
+        1.0 - np.exp(-(z / (n + 1.0 / 3.0 + 0.1 / (n + 1.0))) ** 2 * (n + 1.0 / 6.0)))
+
+
+def _latticeParameters(scheme, spot, strike, rate, sigma, tenor, N):
+    """
+    Return (u, d, p, N) of the binomial scheme 'CRR', 'BBS' or 'LR', N may be adjusted by the scheme.
+    Works element-wise on arrays of contracts.
+    """
+    if scheme in ('CRR', 'BBS'):
+        deltaT = float(tenor) / N
+        u = np.exp(sigma * np.sqrt(deltaT))
+        d = 1.0 / u
+        a = np.exp(rate * deltaT)
+        return u, d, (a - d) / (u - d), N
+    elif scheme == 'LR':
+        # Leisen-Reimer needs an odd number of steps, the tree is then centred on the strike
+        N = N + 1 - N % 2
+        deltaT = float(tenor) / N
+        d1 = (np.log(spot / strike) + (rate + 0.5 * sigma ** 2) * tenor) / (sigma * np.sqrt(tenor))
+        d2 = d1 - sigma * np.sqrt(tenor)
+        a = np.exp(rate * deltaT)
+        p = _peizerPratt(d2, N)
+        u = a * _peizerPratt(d1, N) / p
+        d = (a - p * u) / (1.0 - p)
+        return u, d, p, N
+    raise ValueError('Unsupported lattice scheme={}'.format(scheme))
+
+
+def _europeanRollback(fs, p, discount):
+    """Roll the option values fs of a time step back to the root in one go, without early exercise"""
+    steps = fs.size - 1
+    return discount ** steps * np.dot(binom.pmf(np.arange(steps + 1), steps, p), fs)
+
+
+def _europeanRollbackBatch(fs, p, discount):
+    """Column-wise _europeanRollback for an (i+1, M) array of option values"""
+    steps = fs.shape[0] - 1
+    weights = binom.pmf(np.arange(steps + 1)[:, None], steps, p)
+    return discount ** steps * np.einsum('ij,ij->j', weights, fs)
+
+
+def _binomialTreeReference(callPut, spot, strike, rate, sigma, tenor, N=2000, american=True):
+    """Original list comprehension / temporary array implementation, kept verbatim as benchmark reference"""
 
     # Each time step period
     deltaT = float(tenor) / N
@@ -45,3 +283,81 @@ def binomialTree(callPut, spot, strike, rate, sigma, tenor, N=2000, american=Tru
                 fs[:] = np.maximum(fs[:], -fs2[:] + fs3[:])
 
     return fs[0]
+
+
+def benchmarkBinomialTree(N=2000, repeat=5):
+    """
+    Time the reference implementation against binomialTree, with and without earlyExit.
+    Return a dict of average seconds per pricing, and the prices for cross-checking.
+    """
+    cases = {
+        'reference': lambda: _binomialTreeReference('Put', 100.0, 100.0, 0.03, 0.25, 1.0, N=N),
+        'inPlace': lambda: binomialTree('Put', 100.0, 100.0, 0.03, 0.25, 1.0, N=N),
+        'earlyExit': lambda: binomialTree('Put', 100.0, 100.0, 0.03, 0.25, 1.0, N=N, earlyExit=True),
+        'earlyExitCall': lambda: binomialTree('Call', 100.0, 100.0, 0.03, 0.25, 1.0, N=N, earlyExit=True),
+    }
+    result = dict()
+    for name, case in cases.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            price = case()
+        result[name] = {'seconds': (time.perf_counter() - start) / repeat, 'price': price}
+    return result
+
+
+def benchmarkBinomialTreeBatch(M=100, N=2000):
+    """
+    Time a strike ladder of M American puts priced one by one against a single binomialTreeBatch sweep.
+    Return a dict of seconds for both, and the max absolute price difference.
+    """
+    strikes = np.linspace(70.0, 130.0, M)
+
+    start = time.perf_counter()
+    loopPrices = np.asarray([binomialTree('Put', 100.0, strike, 0.03, 0.25, 1.0, N=N) for strike in strikes])
+    loopTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batchPrices = binomialTreeBatch('Put', 100.0, strikes, 0.03, 0.25, 1.0, N=N)
+    batchTime = time.perf_counter() - start
+
+    return {
+        'contracts': M,
+        'loopTime': loopTime,
+        'batchTime': batchTime,
+        'maxPriceDiff': np.max(np.abs(loopPrices - batchPrices)),
+    }
+
+
+def benchmarkLatticeConvergence(callPut='Put', spot=100.0, strike=105.0, rate=0.03, sigma=0.25, tenor=1.0,
+                                steps=(25, 50, 100, 200, 400, 800, 2000), american=False, referenceSteps=20001):
+    """
+    Price error against wall time for each lattice scheme.
+    European options are checked against blackScholesOptionPrice. American options have no closed form, they are
+    checked against a Leisen-Reimer tree with referenceSteps steps.
+    Return a dict {scheme: [(N, absolute error, seconds)]}.
+    """
+    if american:
+        reference = binomialTree(callPut, spot, strike, rate, sigma, tenor, N=referenceSteps, american=True, scheme='LR')
+    else:
+        reference = blackScholesOptionPrice(callPut, spot, strike, tenor, rate, sigma)
+
+    result = dict()
+    for scheme in ('CRR', 'LR', 'BBS', 'Trinomial', 'CRR-RE-CV'):
+        result[scheme] = []
+        for N in steps:
+            start = time.perf_counter()
+            price = binomialTree(callPut, spot, strike, rate, sigma, tenor, N=N, american=american, scheme=scheme)
+            seconds = time.perf_counter() - start
+            result[scheme].append((N, abs(price - reference), seconds))
+    return result
+
+
+if __name__ == '__main__':
+    for name, stats in benchmarkBinomialTree().items():
+        print(name, stats)
+    print(benchmarkBinomialTreeBatch())
+    for american in (False, True):
+        print('american={}'.format(american))
+        for scheme, rows in benchmarkLatticeConvergence(american=american).items():
+            for N, error, seconds in rows:
+                print('{:10s} N={:5d} error={:.2e} seconds={:.5f}'.format(scheme, N, error, seconds))
@@ -6,7 +6,9 @@ Description:    Black-Scholes utility functions.
 
 import numpy as np
 import math
+import time
 import logging
+from scipy.special import ndtr
 
 
 def ncdf(x):
@@ -29,6 +31,25 @@ def npdf(x):
     return np.exp(-np.square(x) / 2) / np.sqrt(2 * np.pi)
 
 
+def ncdfArray(x):
+    """
+    Vectorized cumulative distribution function for the standard normal distribution.
+    ncdf relies on the scalar math.erf, this one works element-wise on NumPy arrays.
+    """
+    return ndtr(x)
+
+
+def isCallMask(callPut):
+    """
+    Convert callPut into a boolean mask, True for Call and False for Put.
+    Accept either a boolean mask already, or 'Call' / 'Put' labels.
+    """
+    callPut = np.asarray(callPut)
+    if callPut.dtype == bool:
+        return callPut
+    return callPut == 'Call'
+
+
 def blackScholesOptionPrice(callPut, spot, strike, tenor, rate, sigma):
     """
     Black-Scholes option pricing
@@ -84,4 +105,166 @@ def blackScholesSolveImpliedVol(targetPrice, callPut, spot, strike, tenor, rate)
         i = i + 1
 
     logging.debug('blackScholesSolveImpliedVol: After MAX_ITERATIONS={}, best sigma={}'.format(MAX_ITERATIONS, sigma))
-    return sigma
\ No newline at end of file
+    return sigma
+
+
+def blackScholesBatch(callPut, spot, strike, tenor, rate, sigma):
+    """
+    Black-Scholes price and Greeks for arrays of contracts in one pass.
+    Inputs are struct-of-arrays (or scalars broadcast against them), callPut is a boolean mask (True for Call)
+    or an array of 'Call' / 'Put' labels. d1 / d2 and the normal cdf / pdf are computed once and shared.
+    theta is per year, vega and rho are per unit change (not per 1%).
+    Return a dict of arrays with keys price, delta, gamma, vega, theta, rho.
+    """
+    isCall = isCallMask(callPut)
+    spot, strike, tenor, rate, sigma = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (spot, strike, tenor, rate, sigma)])
+
+    sqrtTenor = np.sqrt(tenor)
+    sigmaSqrtTenor = sigma * sqrtTenor
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma ** 2) * tenor) / sigmaSqrtTenor
+    d2 = d1 - sigmaSqrtTenor
+
+    discountedStrike = strike * np.exp(-rate * tenor)
+    # Put values use N(-x) = 1 - N(x), flip the sign once instead of evaluating the cdf twice
+    sign = np.where(isCall, 1.0, -1.0)
+    nd1 = ncdfArray(sign * d1)
+    nd2 = ncdfArray(sign * d2)
+    pdfD1 = npdf(d1)
+
+    price = sign * (spot * nd1 - discountedStrike * nd2)
+    delta = sign * nd1
+    gamma = pdfD1 / (spot * sigmaSqrtTenor)
+    vega = spot * sqrtTenor * pdfD1
+    theta = -spot * pdfD1 * sigma / (2 * sqrtTenor) - sign * rate * discountedStrike * nd2
+    rho = sign * tenor * discountedStrike * nd2
+
+    return {
+        'price': price,
+        'delta': delta,
+        'gamma': gamma,
+        'vega': vega,
+        'theta': theta,
+        'rho': rho,
+    }
+
+
+def impliedVolInitialGuess(targetPrice, callPut, spot, strike, tenor, rate):
+    """
+    Corrado-Miller rational approximation of the implied volatility, used to seed the Newton solver.
+    Puts are converted into calls through put-call parity first.
+    Fall back to the Brenner-Subrahmanyam at-the-money approximation where the square root goes negative.
+    """
+    isCall = isCallMask(callPut)
+    discountedStrike = strike * np.exp(-rate * tenor)
+    callPrice = np.where(isCall, targetPrice, targetPrice + spot - discountedStrike)
+
+    halfMoneyness = (spot - discountedStrike) / 2.0
+    discriminant = (callPrice - halfMoneyness) ** 2 - (spot - discountedStrike) ** 2 / np.pi
+    scale = np.sqrt(2.0 * np.pi / tenor)
+    corradoMiller = scale / (spot + discountedStrike) * (callPrice - halfMoneyness + np.sqrt(np.maximum(discriminant, 0.0)))
+    brennerSubrahmanyam = scale * callPrice / spot
+
+    guess = np.where(discriminant > 0, corradoMiller, brennerSubrahmanyam)
+    return np.where(np.isfinite(guess) & (guess > 0), guess, 0.5)
+
+
+def blackScholesSolveImpliedVolBatch(targetPrice, callPut, spot, strike, tenor, rate,
+                                     maxIterations=100, precision=1.0e-5, lowerVol=1.0e-6, upperVol=5.0):
+    """
+    Solve implied volatilities for a whole option chain at once.
+    Newton steps start from the Corrado-Miller guess, and fall back to bisection inside the bracket
+    [lowerVol, upperVol] whenever a step leaves it or vega is too small to trust. Converged quotes are masked out.
+    Quotes outside the no-arbitrage bounds are never solved.
+    Return (sigma, converged) arrays, sigma is NaN where the quote is not attainable.
+    """
+    isCall = isCallMask(callPut)
+    targetPrice, spot, strike, tenor, rate, isCall = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (targetPrice, spot, strike, tenor, rate)], isCall)
+    shape = targetPrice.shape
+    targetPrice, spot, strike, tenor, rate = [np.ravel(x) for x in (targetPrice, spot, strike, tenor, rate)]
+    sign = np.where(np.ravel(isCall), 1.0, -1.0)
+
+    # No-arbitrage bounds: intrinsic value below, spot (call) or discounted strike (put) above
+    discountedStrike = strike * np.exp(-rate * tenor)
+    lowerBound = np.maximum(sign * (spot - discountedStrike), 0.0)
+    upperBound = np.where(sign > 0, spot, discountedStrike)
+    attainable = (targetPrice > lowerBound) & (targetPrice < upperBound)
+
+    sigma = np.clip(impliedVolInitialGuess(targetPrice, sign > 0, spot, strike, tenor, rate), lowerVol, upperVol)
+    lo = np.full(sigma.shape, lowerVol)
+    hi = np.full(sigma.shape, upperVol)
+    converged = np.zeros(sigma.shape, dtype=bool)
+    active = np.nonzero(attainable)[0]
+
+    iteration = 0
+    while iteration < maxIterations and active.size:
+        s, k, t, r, sg, sig = spot[active], strike[active], tenor[active], rate[active], sign[active], sigma[active]
+
+        # Share d1 / d2 between price and vega
+        sqrtTenor = np.sqrt(t)
+        d1 = (np.log(s / k) + (r + 0.5 * sig ** 2) * t) / (sig * sqrtTenor)
+        d2 = d1 - sig * sqrtTenor
+        price = sg * (s * ncdfArray(sg * d1) - k * np.exp(-r * t) * ncdfArray(sg * d2))
+        vega = s * sqrtTenor * npdf(d1)
+        diff = targetPrice[active] - price
+
+        # Price is increasing in sigma, so the sign of diff tells which side of the root we are on
+        newLo = np.where(diff > 0, sig, lo[active])
+        newHi = np.where(diff > 0, hi[active], sig)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            newton = sig + diff / vega
+        useNewton = (vega > 1.0e-8) & (newton > newLo) & (newton < newHi)
+
+        done = np.abs(diff) < precision
+        lo[active] = newLo
+        hi[active] = newHi
+        sigma[active] = np.where(done, sig, np.where(useNewton, newton, 0.5 * (newLo + newHi)))
+        converged[active] = done
+        active = active[~done]
+        iteration += 1
+
+    logging.debug('blackScholesSolveImpliedVolBatch: quotes={}, converged={}, iterations={}'.format(
+        converged.size, np.count_nonzero(converged), iteration))
+    sigma = np.where(attainable, sigma, np.nan)
+    return sigma.reshape(shape), converged.reshape(shape)
+
+
+def benchmarkBlackScholesBatch(n=100000, seed=0):
+    """
+    Compare blackScholesBatch with looping over the scalar price / delta / gamma / vega functions.
+    Return a dict of wall times in seconds, and the max absolute price difference between both paths.
+    """
+    rng = np.random.default_rng(seed)
+    callPut = np.where(rng.random(n) < 0.5, 'Call', 'Put')
+    spot = rng.uniform(50, 150, n)
+    strike = rng.uniform(50, 150, n)
+    tenor = rng.uniform(0.05, 2.0, n)
+    rate = rng.uniform(0.0, 0.05, n)
+    sigma = rng.uniform(0.1, 0.6, n)
+
+    start = time.perf_counter()
+    scalarPrices = np.empty(n)
+    for i in range(n):
+        args = (callPut[i], spot[i], strike[i], tenor[i], rate[i], sigma[i])
+        scalarPrices[i] = blackScholesOptionPrice(*args)
+        blackScholesDelta(*args)
+        blackScholesGamma(*args)
+        blackScholesVega(*args)
+    scalarTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = blackScholesBatch(callPut, spot, strike, tenor, rate, sigma)
+    batchTime = time.perf_counter() - start
+
+    return {
+        'contracts': n,
+        'scalarTime': scalarTime,
+        'batchTime': batchTime,
+        'speedup': scalarTime / batchTime,
+        'maxPriceDiff': np.max(np.abs(scalarPrices - result['price'])),
+    }
+
+
+if __name__ == '__main__':
+    print(benchmarkBlackScholesBatch())
@@ -0,0 +1,39 @@
+"""
+Id:             data_fetcher.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Market data sources used by DataHub.
+"""
+
+import os
+import pandas
+import yfinance as yf
+
+
+class YahooFetcher:
+    """
+    Daily bars from Yahoo finance, one Ticker per symbol. yf.download keeps its results in module level state reset
+    on every call, Ticker.history does not, so DataHub threads can fetch symbols concurrently.
+    """
+    def fetch(self, symbol, startDate, endDate):
+        """Return a DataFrame of daily bars within [startDate, endDate), indexed by date, as yf.download does"""
+        df = yf.Ticker(symbol).history(start=startDate, end=endDate, auto_adjust=True, actions=False,
+                                       raise_errors=True)
+        # Exchange local timestamps at midnight, keep the date only
+        df.index = pandas.DatetimeIndex(df.index).tz_localize(None).rename('Date')
+        df.columns = pandas.MultiIndex.from_product([df.columns, [symbol]], names=['Price', 'Ticker'])
+        return df
+
+
+class CsvFetcher:
+    """
+    Daily bars from local <root>/<symbol>.csv files, with a date first column and Open / High / Low / Close / Volume
+    columns. Stands in for Yahoo when running offline or in tests.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def fetch(self, symbol, startDate, endDate):
+        df = pandas.read_csv(os.path.join(self.root, '{}.csv'.format(symbol)), index_col=0, parse_dates=True)
+        df = df[(df.index >= pandas.Timestamp(startDate)) & (df.index < pandas.Timestamp(endDate))]
+        df.columns = pandas.MultiIndex.from_product([df.columns, [symbol]], names=['Price', 'Ticker'])
+        return df
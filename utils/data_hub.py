@@ -4,17 +4,56 @@ Copyright:      2018 xiaokang.guan All rights reserved.
 Description:    Data hub to download data from web.
 """
 
+import time
 import logging
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import yfinance as yf
 import pandas
-from utils.market_tick import MarketTick
+from utils.market_panel import MarketPanel
+from utils.market_replay import MarketReplay
+from utils.market_cleansing import cleanseMarketPanel
+from utils.trading_calendar import TradingCalendar
+from utils.data_fetcher import YahooFetcher
+from utils.intraday import readIntradayFile, ticksToBars, resampleBars, barsToFrame, TICK_COLUMNS
 
 
-class DataHub:
+class DownloadReport:
+    """Outcome of one bulk download, per symbol"""
     def __init__(self):
-        pass
+        self.succeeded = []
+        # symbol: repr of the last exception, once all attempts failed
+        self.failed = dict()
+        # symbol: number of attempts used
+        self.attempts = dict()
+
+    def __str__(self):
+        return 'DownloadReport<succeeded={}, failed={}>'.format(len(self.succeeded), self.failed)
+
+
+class DataHub:
+    def __init__(self, store=None, offline=False, fetcher=None, maxWorkers=8, retries=2, backoff=1.0,
+                 intradayStore=None):
+        """
+        :param store: optional LocalDataStore, downloads are persisted there and only missing date ranges are fetched
+        :param offline: serve everything from store, never call the fetcher
+        :param fetcher: data source with fetch(symbol, startDate, endDate), YahooFetcher by default
+        :param maxWorkers: max number of symbols downloaded concurrently
+        :param retries: number of retries per symbol after a failed download
+        :param backoff: seconds before the first retry, doubled on every further retry
+        :param intradayStore: optional LocalDataStore of intraday bars or trade ticks, see ingestIntraday
+        """
+        self.store = store
+        self.offline = offline
+        self.fetcher = fetcher if fetcher is not None else YahooFetcher()
+        self.maxWorkers = maxWorkers
+        self.retries = retries
+        self.backoff = backoff
+        self.intradayStore = intradayStore
+        # Cleansed and adjusted panels by request, see getAdjustedMarketPanel
+        self.adjustedPanels = dict()
+        # DownloadReport of the last _downloadData
+        self.lastReport = None
 
     def _downloadData(self, startDate=datetime.date(2017, 1, 1), endDate=datetime.date.today(), symbols=['AAPL', 'SPY']):
         """
@@ -30,15 +69,22 @@ class DataHub:
 
         Now we allow different indexes across different symbol DataFrames
         And we will simply remove all 0 or NaN in every DataFrame
+
+        With a store, only the date ranges missing from it are downloaded, the rest is read from disk.
+        Symbols are downloaded concurrently by up to maxWorkers threads, each retried with exponential backoff.
+        Symbols failing every attempt are left out, and listed in self.lastReport. With a store, a symbol whose
+        missing range failed is still served from disk, but reported as failed as well.
         """
+        report = DownloadReport()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.maxWorkers, len(symbols)))) as pool:
+            results = list(pool.map(lambda symbol: self._loadSymbol(symbol, startDate, endDate, report), symbols))
+
         symbolData = dict()
-        for symbol in symbols:
-            try:
-                df = yf.download(symbol, startDate, endDate)
-            except Exception as e:
-                logging.exception(f'DataHub: _downloadData: Cannot download historical data for symbol={symbol}')
-                continue
-            symbolData[symbol] = df
+        for symbol, df in zip(symbols, results):
+            if df is not None:
+                symbolData[symbol] = df
+                report.succeeded.append(symbol)
+        self.lastReport = report
 
         # Cleanse data: remove dates where there is NaN or 0
         for symbol, df in symbolData.items():
@@ -49,46 +95,183 @@ class DataHub:
             symbolData[symbol] = df.sort_index(ascending=True)
 
         logging.info('============================================================')
-        logging.info('DataHub: downlaodData: Completed startDate={}, endDate={}'.format(startDate, endDate))
+        logging.info('DataHub: downlaodData: Completed startDate={}, endDate={}, report={}'.format(startDate, endDate, report))
         logging.info('============================================================')
         return symbolData
 
+    def _loadSymbol(self, symbol, startDate, endDate, report):
+        """
+        Return the DataFrame of symbol within [startDate, endDate), or None if it cannot be loaded.
+        With a store, only the date ranges missing from it are fetched, then everything is read from disk. Ranges
+        without any trading day are never fetched, an empty frame there is no failure.
+        """
+        if self.store is None:
+            if not self._hasTradingDays(startDate, endDate):
+                return None
+            return self._fetchWithRetry(symbol, startDate, endDate, report)
+
+        for gapStart, gapEnd in self.store.getMissingRanges(symbol, startDate, endDate):
+            if not self._hasTradingDays(gapStart, gapEnd):
+                # Weekends and holidays only, nothing to fetch, e.g. an endDate on a Saturday
+                self.store.markCovered(symbol, gapStart, gapEnd)
+                continue
+            if self.offline:
+                logging.warning(f'DataHub: _loadSymbol: Offline, missing symbol={symbol} from {gapStart} to {gapEnd}')
+                continue
+            df = self._fetchWithRetry(symbol, gapStart, gapEnd, report)
+            if df is not None and not df.empty:
+                self.store.write(symbol, df, gapStart, gapEnd)
+        return self.store.read(symbol, startDate, endDate)
+
+    @staticmethod
+    def _hasTradingDays(startDate, endDate):
+        """Whether [startDate, endDate) has any NYSE business day, an empty download is expected otherwise"""
+        lastDate = pandas.Timestamp(endDate) - pandas.Timedelta(days=1)
+        return pandas.Timestamp(startDate) <= lastDate and len(TradingCalendar.businessDays(startDate, lastDate)) > 0
+
+    def _fetchWithRetry(self, symbol, startDate, endDate, report):
+        """Fetch symbol, retrying with exponential backoff on errors and empty frames. None once all attempts failed."""
+        for attempt in range(self.retries + 1):
+            report.attempts[symbol] = report.attempts.get(symbol, 0) + 1
+            try:
+                df = self.fetcher.fetch(symbol, startDate, endDate)
+                # yfinance reports most failures as an empty frame
+                if df is None or df.empty:
+                    raise ValueError('No data for symbol={} from {} to {}'.format(symbol, startDate, endDate))
+                return df
+            except Exception as e:
+                error = e
+                logging.warning(f'DataHub: _fetchWithRetry: Cannot download historical data for symbol={symbol}, '
+                                f'attempt={attempt + 1}, error={e!r}')
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        logging.error(f'DataHub: _fetchWithRetry: Giving up symbol={symbol} after {self.retries + 1} attempts')
+        report.failed[symbol] = repr(error)
+        return None
+
     def downloadDataFromYahoo(self, startDate, endDate, symbols):
         return self._downloadData(startDate, endDate, symbols)
 
-    def getDailyMarketTicks(self, startDate, endDate, symbols):
+    def getMarketPanel(self, startDate, endDate, symbols):
         """
-        Dictionary representation {date: {symbol: market_tick}}
+        Panel representation, aligned date x symbol arrays of open / high / low / close / volume / close_return
         :param startDate: datetime.date
         :param endDate: datetime.date
         :param symbols: [string]
-        :return: outer key pandas timestamps as index
+        :return: MarketPanel with trading days as rows, i.e. NYSE business days and any other day with data
         """
         symbolData = self.downloadDataFromYahoo(startDate, endDate, symbols)
-        dtIndexes = pandas.date_range(startDate, endDate, freq='B')
+        dataDates = pandas.DatetimeIndex([])
+        for df in symbolData.values():
+            dataDates = dataDates.union(df.index)
+        # Keep dates with data even if the calendar says holiday, e.g. one-off openings or other exchanges
+        dataDates = dataDates[(dataDates >= pandas.Timestamp(startDate)) & (dataDates <= pandas.Timestamp(endDate))]
+        calendar = TradingCalendar.businessDays(startDate, endDate, extraDates=dataDates)
+        return MarketPanel.fromSymbolData(symbolData, calendar.toIndex())
 
-        # Add daily percentage changes
-        pctChange = dict([(sym, df.pct_change(1)) for sym, df in symbolData.items()])
+    def getAdjustedMarketPanel(self, startDate, endDate, symbols, **cleansing):
+        """
+        Cleansed and adjusted panel, computed once per request and cached for later callers. With a store, the panel
+        is also persisted there once its bars are fully covered, so later DataHubs and runs read it back instead of
+        downloading and cleansing again.
+        :param startDate: datetime.date
+        :param endDate: datetime.date
+        :param symbols: [string]
+        :param cleansing: keyword arguments of cleanseMarketPanel, e.g. splits, dividends, useAdjClose, fillLimit
+        :return: MarketPanel with provenance and adjustment
+        """
+        key = repr((str(startDate), str(endDate), tuple(symbols), sorted(cleansing.items())))
+        panel = self.adjustedPanels.get(key)
+        if panel is None and self.store is not None:
+            panel = self.store.readPanel(key)
+        if panel is None:
+            panel = cleanseMarketPanel(self.getMarketPanel(startDate, endDate, symbols), **cleansing)
+            if self.store is not None and self._isCovered(startDate, endDate, symbols):
+                self.store.writePanel(key, panel)
+        self.adjustedPanels[key] = panel
+        return panel
 
-        perDay = dict()
-        for dtIdx in dtIndexes:
-            perSymbol = dict()
-            for symbol in symbolData.keys():
-                if dtIdx in symbolData[symbol].index:
-                    # Construct marketTick for this tradingDate
-                    # YFinance changed API, now symboData[symbol] columns are MultiIndex
-                    open = symbolData[symbol].loc[dtIdx, ('Open', symbol)]
-                    close = symbolData[symbol].loc[dtIdx, ('Close', symbol)]
-                    high = symbolData[symbol].loc[dtIdx, ('High', symbol)]
-                    low = symbolData[symbol].loc[dtIdx, ('Low', symbol)]
-                    volume = symbolData[symbol].loc[dtIdx, ('Volume', symbol)]
+    def _isCovered(self, startDate, endDate, symbols):
+        """True once the store holds every symbol over [startDate, endDate), its bars will not change anymore"""
+        return all(not self.store.getMissingRanges(symbol, startDate, endDate) for symbol in symbols)
 
-                    # Daily close price return
-                    close_return = pctChange[symbol].loc[dtIdx, ('Close', symbol)]
+    def getDailyMarketTicks(self, startDate, endDate, symbols):
+        """
+        Dictionary representation {date: {symbol: market_tick}}
+        :param startDate: datetime.date
+        :param endDate: datetime.date
+        :param symbols: [string]
+        :return: outer key pandas timestamps as index, trading days without any data map to an empty dict
+        """
+        return self.getMarketPanel(startDate, endDate, symbols).toDailyMarketTicks()
 
-                    marketTick = MarketTick(symbol, open, close, high, low, volume, close_return, dtIdx)
-                    perSymbol[symbol] = marketTick
+    def getMarketReplay(self, startDate, endDate, symbols, prefetch=0):
+        """
+        Streaming representation, yields (date, {symbol: market_tick}) one business day at a time
+        :param startDate: datetime.date
+        :param endDate: datetime.date
+        :param symbols: [string]
+        :param prefetch: number of days built ahead on a background thread, 0 builds each day on demand
+        :return: MarketReplay
+        """
+        return MarketReplay(self.getMarketPanel(startDate, endDate, symbols), prefetch=prefetch)
 
-            perDay[dtIdx] = perSymbol
+    def _checkIntradayStore(self, caller):
+        if self.intradayStore is None:
+            raise ValueError('DataHub: {}: No intradayStore, pass one to DataHub(intradayStore=...)'.format(caller))
 
-        return perDay
+    def ingestIntraday(self, symbol, path):
+        """
+        Load minute bars or trade ticks of a symbol from a local .csv / .parquet file into the intraday store
+        :param symbol: string
+        :param path: file path, see readIntradayFile for the layout
+        :return: number of rows ingested
+        """
+        self._checkIntradayStore('ingestIntraday')
+        df = readIntradayFile(path)
+        if df.empty:
+            return 0
+        startDate = df.index[0].date()
+        endDate = df.index[-1].date() + datetime.timedelta(days=1)
+        self.intradayStore.write(symbol, df, startDate, endDate)
+        logging.info('DataHub: ingestIntraday: symbol={}, path={}, rows={}'.format(symbol, path, len(df)))
+        return len(df)
+
+    def getIntradayBars(self, startDate, endDate, symbols, barSize='1min'):
+        """
+        Intraday bars resampled from the intraday store
+        :param startDate: datetime.date or pandas.Timestamp
+        :param endDate: datetime.date or pandas.Timestamp, exclusive
+        :param symbols: [string]
+        :param barSize: pandas offset alias, e.g. '1min', '30min', '1h'
+        :return: {symbol: DataFrame} as downloadDataFromYahoo, symbols without data are left out
+        """
+        self._checkIntradayStore('getIntradayBars')
+        # Align the bars of all symbols on the same origin, whatever day each one starts trading
+        origin = None if startDate is None else pandas.Timestamp(pandas.Timestamp(startDate).date()).value
+        symbolData = dict()
+        for symbol in symbols:
+            arrays = self.intradayStore.readArrays(symbol, startDate, endDate)
+            if arrays is None or arrays[0].size == 0:
+                logging.warning('DataHub: getIntradayBars: no intraday data for symbol={}'.format(symbol))
+                continue
+            times, data = arrays
+            if set(TICK_COLUMNS).issubset(data):
+                labels, bars = ticksToBars(times, data['Price'], data['Size'], barSize, origin)
+            else:
+                labels, bars = resampleBars(times, data, barSize, origin)
+            symbolData[symbol] = barsToFrame(symbol, labels, bars)
+        return symbolData
+
+    def getIntradayReplay(self, startDate, endDate, symbols, barSize='1min', prefetch=0):
+        """
+        Streaming representation of intraday bars, yields (bar start, {symbol: market_tick}) for every bar in which
+        at least one symbol traded
+        :param barSize: pandas offset alias, e.g. '1min', '30min', '1h'
+        :return: MarketReplay
+        """
+        symbolData = self.getIntradayBars(startDate, endDate, symbols, barSize)
+        dtIndexes = pandas.DatetimeIndex([])
+        for df in symbolData.values():
+            dtIndexes = dtIndexes.union(df.index)
+        return MarketReplay(MarketPanel.fromSymbolData(symbolData, dtIndexes), prefetch=prefetch)
@@ -0,0 +1,202 @@
+"""
+Id:             data_store.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Local columnar on-disk store for downloaded market data.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import datetime
+import numpy as np
+import pandas
+from utils.market_panel import MarketPanel, PANEL_FIELDS
+
+# MarketPanel arrays persisted by writePanel, besides dates and symbols
+PANEL_ARRAYS = PANEL_FIELDS + ['valid', 'adj_close', 'provenance', 'adjustment']
+
+
+class LocalDataStore:
+    """
+    Persistent store of daily bars keyed by symbol, in a memory-mapped NumPy layout:
+    <root>/<symbol>/dates.npy      int64 nanoseconds since epoch, ascending, repeated only by ticks of the same time
+    <root>/<symbol>/<column>.npy   one float64 array per column, e.g. Open, Close, Volume
+    <root>/<symbol>/meta.json      column names, and the [start, end) date ranges already downloaded
+    <root>/_panels/<sha1>.npz      derived panels, see writePanel
+    Coverage is tracked by requested date range rather than by dates with data, so weekends and holidays inside a
+    downloaded range are not fetched again.
+    """
+    def __init__(self, root='data'):
+        self.root = root
+
+    def _symbolDir(self, symbol):
+        return os.path.join(self.root, symbol)
+
+    def _loadMeta(self, symbol):
+        path = os.path.join(self._symbolDir(symbol), 'meta.json')
+        if not os.path.exists(path):
+            return {'columns': [], 'coverage': []}
+        with open(path) as file:
+            return json.load(file)
+
+    def _saveMeta(self, symbol, meta):
+        with open(os.path.join(self._symbolDir(symbol), 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=1)
+
+    @staticmethod
+    def _toDate(value):
+        """Accept datetime.date, datetime.datetime or pandas.Timestamp"""
+        return pandas.Timestamp(value).date()
+
+    @staticmethod
+    def _columnFile(column):
+        return '{}.npy'.format(column.replace(' ', '_'))
+
+    def getCoverage(self, symbol):
+        """Return the list of [start, end) datetime.date ranges already stored"""
+        return [(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))
+                for start, end in self._loadMeta(symbol)['coverage']]
+
+    def getMissingRanges(self, symbol, startDate, endDate):
+        """Return the list of [start, end) datetime.date gaps of [startDate, endDate) not stored yet"""
+        startDate, endDate = self._toDate(startDate), self._toDate(endDate)
+        gaps = []
+        cursor = startDate
+        for start, end in self.getCoverage(symbol):
+            if end <= cursor:
+                continue
+            if start >= endDate:
+                break
+            if start > cursor:
+                gaps.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < endDate:
+            gaps.append((cursor, endDate))
+        return gaps
+
+    def readArrays(self, symbol, startDate, endDate):
+        """
+        Return the stored rows within [startDate, endDate) as (int64 nanosecond times, {column: float64 array}),
+        without building a DataFrame, or None if nothing is stored for the symbol. startDate / endDate None means
+        unbounded, they can be dates or timestamps.
+        """
+        meta = self._loadMeta(symbol)
+        if not meta['columns']:
+            return None
+
+        symbolDir = self._symbolDir(symbol)
+        dates = np.load(os.path.join(symbolDir, 'dates.npy'), mmap_mode='r')
+        lo = 0 if startDate is None else np.searchsorted(dates, pandas.Timestamp(startDate).value, side='left')
+        hi = dates.size if endDate is None else np.searchsorted(dates, pandas.Timestamp(endDate).value, side='left')
+
+        data = dict()
+        for column in meta['columns']:
+            values = np.load(os.path.join(symbolDir, self._columnFile(column)), mmap_mode='r')
+            data[column] = np.array(values[lo:hi])
+        return np.array(dates[lo:hi]), data
+
+    def read(self, symbol, startDate, endDate):
+        """
+        Return the stored bars within [startDate, endDate) as a DataFrame indexed by date, with the same
+        (Price, Ticker) MultiIndex columns as yfinance, or None if nothing is stored for the symbol.
+        startDate / endDate None means unbounded.
+        """
+        arrays = self.readArrays(symbol, startDate, endDate)
+        if arrays is None:
+            return None
+
+        times, data = arrays
+        index = pandas.DatetimeIndex(times.astype('datetime64[ns]'), name='Date')
+        df = pandas.DataFrame(dict(((column, symbol), values) for column, values in data.items()), index=index)
+        df.columns = pandas.MultiIndex.from_tuples(df.columns, names=['Price', 'Ticker'])
+        return df
+
+    def write(self, symbol, df, startDate, endDate):
+        """
+        Merge the bars downloaded for [startDate, endDate) into the store, replacing what was stored within that
+        range, and mark it as covered.
+        df is indexed by date, columns are either plain names or yfinance (Price, Ticker) MultiIndex.
+        An empty df is not stored, as yfinance returns one on failure rather than raising. Coverage stops before
+        today, see markCovered.
+        """
+        if df is None or df.empty:
+            logging.warning('LocalDataStore: write: Nothing to store for symbol={} from {} to {}'.format(
+                symbol, startDate, endDate))
+            return
+        symbolDir = self._symbolDir(symbol)
+        os.makedirs(symbolDir, exist_ok=True)
+        meta = self._loadMeta(symbol)
+
+        df = df.copy()
+        if isinstance(df.columns, pandas.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
+        df.index = pandas.DatetimeIndex(df.index).tz_localize(None)
+
+        existing = self.read(symbol, None, None)
+        if existing is not None:
+            existing.columns = existing.columns.get_level_values(0)
+            # The new rows replace the stored [startDate, endDate) slice, and stored rows on their timestamps. Rows
+            # of df are never deduplicated, trade ticks often share a timestamp
+            replaced = (existing.index >= pandas.Timestamp(startDate)) & (existing.index < pandas.Timestamp(endDate))
+            df = pandas.concat([existing[~replaced & ~existing.index.isin(df.index)], df])
+        df = df.sort_index(kind='stable')
+
+        np.save(os.path.join(symbolDir, 'dates.npy'), df.index.values.astype('datetime64[ns]').astype(np.int64))
+        columns = [str(column) for column in df.columns]
+        for column in columns:
+            np.save(os.path.join(symbolDir, self._columnFile(column)), df[column].to_numpy(dtype=np.float64))
+
+        meta['columns'] = columns
+        self._saveMeta(symbol, meta)
+        self.markCovered(symbol, startDate, endDate)
+        logging.debug('LocalDataStore: write: symbol={}, rows={}'.format(symbol, len(df)))
+
+    def markCovered(self, symbol, startDate, endDate):
+        """
+        Record [startDate, endDate) as downloaded, e.g. a range without any trading day, so it is not fetched again.
+        Coverage stops before today, days which may still get data are fetched again.
+        """
+        os.makedirs(self._symbolDir(symbol), exist_ok=True)
+        meta = self._loadMeta(symbol)
+        coverage = self.getCoverage(symbol)
+        startDate, endDate = self._toDate(startDate), min(self._toDate(endDate), datetime.date.today())
+        if startDate < endDate:
+            coverage.append((startDate, endDate))
+        coverage = sorted(coverage)
+        merged = []
+        for start, end in coverage:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        meta['coverage'] = [[start.isoformat(), end.isoformat()] for start, end in merged]
+        self._saveMeta(symbol, meta)
+        logging.debug('LocalDataStore: markCovered: symbol={}, coverage={}'.format(symbol, meta['coverage']))
+
+    def _panelFile(self, key):
+        return os.path.join(self.root, '_panels', '{}.npz'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def readPanel(self, key):
+        """Return the MarketPanel stored by writePanel under the string key, or None"""
+        path = self._panelFile(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            if str(arrays['key']) != key:
+                return None
+            dates = pandas.DatetimeIndex(arrays['dates'].astype('datetime64[ns]'))
+            fields = dict((field, arrays[field]) for field in PANEL_ARRAYS if field in arrays)
+            return MarketPanel(dates, [str(symbol) for symbol in arrays['symbols']], **fields)
+
+    def writePanel(self, key, panel):
+        """
+        Persist a derived MarketPanel, e.g. a cleansed and adjusted one, under the string key. The caller owns
+        invalidation, a panel is only worth storing once the bars it was built from are fully covered.
+        """
+        path = self._panelFile(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fields = dict((field, getattr(panel, field)) for field in PANEL_ARRAYS if getattr(panel, field) is not None)
+        np.savez(path, key=np.array(key), dates=panel.dates.values.astype('datetime64[ns]').astype(np.int64),
+                 symbols=np.array(panel.symbols, dtype=str), **fields)
+        logging.debug('LocalDataStore: writePanel: {}'.format(panel))
@@ -0,0 +1,141 @@
+"""
+Id:             intraday.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Intraday bars and trade ticks: file ingest and vectorized resampling.
+"""
+
+import time
+import numpy as np
+import pandas
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+TICK_COLUMNS = ['Price', 'Size']
+
+
+def readIntradayFile(path):
+    """
+    Read minute bars (Open / High / Low / Close / Volume) or trade ticks (Price / Size) from a .csv or .parquet
+    file, with the timestamp as first column for csv or as index for parquet.
+    Return a DataFrame with a tz naive DatetimeIndex in ascending order and float64 columns.
+    """
+    if path.endswith('.parquet'):
+        # Needs pyarrow or fastparquet, only when parquet files are used
+        df = pandas.read_parquet(path)
+    else:
+        df = pandas.read_csv(path, index_col=0, parse_dates=True)
+    index = pandas.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index = index.tz_convert(None)
+    df.index = index.rename('Date')
+
+    if set(BAR_COLUMNS).issubset(df.columns):
+        df = df[BAR_COLUMNS]
+    elif set(TICK_COLUMNS).issubset(df.columns):
+        df = df[TICK_COLUMNS]
+    else:
+        raise ValueError('readIntradayFile: {} needs either {} or {} columns, got {}'.format(
+            path, BAR_COLUMNS, TICK_COLUMNS, list(df.columns)))
+    return df.astype(np.float64).sort_index(kind='stable')
+
+
+def _barStarts(times, barSize, origin=None):
+    """
+    Group ascending int64 nanosecond times into bars of barSize (e.g. '5min'), left closed and labelled by their
+    start, aligned to origin (int64 nanoseconds), by default midnight of the first day as pandas resample with
+    origin='start_day'. Bar sizes which do not divide a day (e.g. '7min') run on across days from the origin.
+    Return (labels, starts), the bar labels and the index of each bar's first row.
+    """
+    width = pandas.Timedelta(barSize).value
+    if origin is None:
+        day = pandas.Timedelta('1D').value
+        origin = times[0] // day * day
+    buckets = (times - origin) // width
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    return origin + buckets[starts] * width, starts
+
+
+def ticksToBars(times, prices, sizes, barSize, origin=None):
+    """
+    Aggregate trade ticks into OHLCV bars, all in one pass of ufunc reduceat.
+    :param times: int64 nanoseconds, ascending
+    :param origin: int64 nanoseconds the bars are aligned to, see _barStarts
+    :return: (labels, {column: array}) with BAR_COLUMNS, bars without any tick are absent
+    """
+    if times.size == 0:
+        return times, dict((column, np.empty(0)) for column in BAR_COLUMNS)
+    labels, starts = _barStarts(times, barSize, origin)
+    ends = np.r_[starts[1:], times.size] - 1
+    return labels, {
+        'Open': prices[starts],
+        'High': np.maximum.reduceat(prices, starts),
+        'Low': np.minimum.reduceat(prices, starts),
+        'Close': prices[ends],
+        'Volume': np.add.reduceat(sizes, starts),
+    }
+
+
+def resampleBars(times, bars, barSize, origin=None):
+    """
+    Aggregate OHLCV bars into bars of a larger barSize, e.g. minute bars into 30min or 1D bars.
+    :param times: int64 nanoseconds of the bar starts, ascending
+    :param bars: {column: array} with BAR_COLUMNS
+    :param origin: int64 nanoseconds the bars are aligned to, see _barStarts
+    :return: (labels, {column: array}) with BAR_COLUMNS
+    """
+    if times.size == 0:
+        return times, dict((column, np.empty(0)) for column in BAR_COLUMNS)
+    labels, starts = _barStarts(times, barSize, origin)
+    ends = np.r_[starts[1:], times.size] - 1
+    return labels, {
+        'Open': bars['Open'][starts],
+        'High': np.maximum.reduceat(bars['High'], starts),
+        'Low': np.minimum.reduceat(bars['Low'], starts),
+        'Close': bars['Close'][ends],
+        'Volume': np.add.reduceat(bars['Volume'], starts),
+    }
+
+
+def barsToFrame(symbol, labels, bars):
+    """DataFrame of bars with the same (Price, Ticker) MultiIndex columns as DataHub.downloadDataFromYahoo"""
+    df = pandas.DataFrame(dict(((column, symbol), bars[column]) for column in BAR_COLUMNS),
+                          index=pandas.DatetimeIndex(labels.astype('datetime64[ns]'), name='Date'))
+    df.columns = pandas.MultiIndex.from_tuples(df.columns, names=['Price', 'Ticker'])
+    return df
+
+
+def benchmarkResample(rows=5000000, barSize='5min'):
+    """
+    Time ticksToBars against pandas resample on random ticks.
+    Return a dict of seconds for both, and whether bar labels and values match.
+    """
+    rng = np.random.default_rng(0)
+    # Start off midnight, so that bar alignment is checked as well
+    first = pandas.Timestamp('2020-01-02 09:30').value
+    times = first + np.sort(rng.integers(0, 60 * 24 * 3600 * 10 ** 9, rows))
+    prices = 100.0 + np.cumsum(rng.normal(0.0, 0.01, rows))
+    sizes = rng.integers(1, 1000, rows).astype(np.float64)
+
+    start = time.perf_counter()
+    labels, bars = ticksToBars(times, prices, sizes, barSize)
+    vectorizedTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    series = pandas.Series(prices, index=pandas.DatetimeIndex(times.astype('datetime64[ns]')))
+    expected = series.resample(barSize).ohlc().dropna()
+    volume = pandas.Series(sizes, index=series.index).resample(barSize).sum()
+    pandasTime = time.perf_counter() - start
+
+    return {
+        'ticks': rows,
+        'bars': labels.size,
+        'ticksToBarsTime': vectorizedTime,
+        'pandasTime': pandasTime,
+        'labelsMatch': np.array_equal(expected.index.values.astype(np.int64), labels),
+        'maxPriceDiff': max(np.max(np.abs(expected[column].to_numpy() - bars[column.capitalize()]))
+                            for column in ['open', 'high', 'low', 'close']),
+        'maxVolumeDiff': np.max(np.abs(volume[volume > 0].to_numpy() - bars['Volume'])),
+    }
+
+
+if __name__ == '__main__':
+    print(benchmarkResample())
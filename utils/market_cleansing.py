@@ -0,0 +1,124 @@
+"""
+Id:             market_cleansing.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Vectorized cleansing and corporate action adjustment of a MarketPanel.
+"""
+
+import logging
+import warnings
+import numpy as np
+import pandas
+from utils.market_panel import MarketPanel
+
+# Provenance bitmask, per date and symbol
+CLEANSE_MISSING = 1                 # No bar from the source
+CLEANSE_INVALID = 2                 # Bar dropped, a field was 0 or NaN
+CLEANSE_FILLED = 4                  # Bar forward filled from the previous close
+CLEANSE_OUTLIER = 8                 # Return or high / low inconsistent with the rest of the series
+CLEANSE_SPLIT_ADJUSTED = 16         # Prices and volume scaled for a later split
+CLEANSE_DIVIDEND_ADJUSTED = 32      # Prices scaled for a later dividend
+CLEANSE_ADJ_CLOSE_ADJUSTED = 64     # Prices scaled by the source's adjusted close over close
+
+# Scale of the median absolute deviation to a normal standard deviation
+MAD_SCALE = 1.4826
+
+
+def _eventFactors(panel, events, factor):
+    """
+    Backward adjustment factors of per symbol events {symbol: [(date, value)]}: prices before an event date are
+    multiplied by factor(value, row, column) of the event, and by those of every later event.
+    """
+    eventFactors = np.ones(panel.close.shape)
+    for symbol, symbolEvents in (events or dict()).items():
+        j = panel.symbolIndex.get(symbol)
+        if j is None:
+            continue
+        for date, value in symbolEvents:
+            i = panel.dates.searchsorted(pandas.Timestamp(date), side='left')
+            if 0 < i < len(panel.dates):
+                eventFactors[i, j] *= factor(value, i, j)
+    # Product over the events strictly after each row
+    cumulative = np.cumprod(eventFactors[::-1], axis=0)[::-1]
+    return np.vstack([cumulative[1:], np.ones((1, cumulative.shape[1]))])
+
+
+def _previousValid(values, valid):
+    """values of the previous valid row of the same column, NaN before the first one"""
+    masked = pandas.DataFrame(np.where(valid, values, np.nan))
+    return masked.ffill().shift(1).to_numpy()
+
+
+def cleanseMarketPanel(panel, splits=None, dividends=None, useAdjClose=False, fillLimit=0, outlierThreshold=10.0,
+                       dropOutliers=False):
+    """
+    Cleanse and adjust all the symbols of a panel at once. Return a new MarketPanel with adjusted
+    open / high / low / close / volume, close_return recomputed over the remaining bars, the CLEANSE_* provenance
+    bitmask and the price adjustment factor.
+    :param splits: {symbol: [(date, ratio)]}, e.g. ratio 2.0 for a 2 for 1 split effective on date
+    :param dividends: {symbol: [(exDate, amount)]}, cash amount per share
+    :param useAdjClose: take the adjustment factor from adj_close / close wherever the source provides adj_close,
+        instead of splits and dividends
+    :param fillLimit: forward fill up to fillLimit consecutive missing bars with the previous close and 0 volume
+    :param outlierThreshold: flag log returns further than this many robust standard deviations from the median
+    :param dropOutliers: drop flagged outliers too, otherwise they are only flagged
+    """
+    shape = panel.close.shape
+    provenance = np.where(panel.valid, 0, CLEANSE_MISSING).astype(np.uint8)
+    fields = np.stack([panel.open, panel.high, panel.low, panel.close, panel.volume])
+
+    # Bars with any 0 or NaN field, as DataHub drops them per symbol
+    invalid = panel.valid & np.any(np.isnan(fields) | (fields == 0), axis=0)
+    provenance[invalid] |= CLEANSE_INVALID
+    valid = panel.valid & ~invalid
+
+    # Adjustment factors
+    splitFactor = _eventFactors(panel, splits, lambda ratio, i, j: 1.0 / ratio)
+    previousClose = _previousValid(panel.close, valid)
+    dividendFactor = _eventFactors(panel, dividends, lambda amount, i, j: 1.0 - amount / previousClose[i, j])
+    adjustment = splitFactor * dividendFactor
+    hasAdjClose = np.zeros(shape, dtype=bool)
+    if useAdjClose:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            adjCloseFactor = panel.adj_close / panel.close
+        hasAdjClose = valid & np.isfinite(adjCloseFactor)
+        adjustment = np.where(hasAdjClose, adjCloseFactor, adjustment)
+        splitFactor = np.where(hasAdjClose, 1.0, splitFactor)
+        provenance[hasAdjClose & (adjCloseFactor != 1.0)] |= CLEANSE_ADJ_CLOSE_ADJUSTED
+    provenance[valid & ~hasAdjClose & (splitFactor != 1.0)] |= CLEANSE_SPLIT_ADJUSTED
+    provenance[valid & ~hasAdjClose & (dividendFactor != 1.0)] |= CLEANSE_DIVIDEND_ADJUSTED
+
+    open, high, low, close = (np.where(valid, values * adjustment, np.nan) for values in fields[:4])
+    volume = np.where(valid, fields[4] / splitFactor, np.nan)
+
+    # Outliers: robust z-score of log returns, and inconsistent high / low
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # Symbols without any return have an all NaN median
+        warnings.simplefilter('ignore', RuntimeWarning)
+        logReturn = np.log(close / _previousValid(close, valid))
+        deviation = np.abs(logReturn - np.nanmedian(logReturn, axis=0))
+        mad = MAD_SCALE * np.nanmedian(deviation, axis=0)
+        outlier = (mad > 0) & (deviation > outlierThreshold * mad)
+    outlier |= valid & ((high < np.maximum(open, close)) | (low > np.minimum(open, close)))
+    provenance[outlier] |= CLEANSE_OUTLIER
+    if dropOutliers:
+        valid = valid & ~outlier
+        open, high, low, close, volume = (np.where(valid, values, np.nan)
+                                          for values in (open, high, low, close, volume))
+
+    # Forward fill short gaps with the previous close
+    if fillLimit > 0:
+        filledClose = pandas.DataFrame(np.where(valid, close, np.nan)).ffill(limit=fillLimit).to_numpy()
+        filled = ~valid & np.isfinite(filledClose)
+        open, high, low, close = (np.where(filled, filledClose, values) for values in (open, high, low, close))
+        volume = np.where(filled, 0.0, volume)
+        provenance[filled] |= CLEANSE_FILLED
+        valid = valid | filled
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        closeReturn = np.where(valid, close / _previousValid(close, valid) - 1.0, np.nan)
+
+    logging.debug('cleanseMarketPanel: invalid={}, outliers={}, filled={}, adjusted={}'.format(
+        np.count_nonzero(invalid), np.count_nonzero(outlier),
+        np.count_nonzero(provenance & CLEANSE_FILLED), np.count_nonzero(valid & (adjustment != 1.0))))
+    return MarketPanel(panel.dates, panel.symbols, open, high, low, close, volume, closeReturn, valid,
+                       adj_close=panel.adj_close, provenance=provenance, adjustment=adjustment)
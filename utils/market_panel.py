@@ -0,0 +1,86 @@
+"""
+Id:             market_panel.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Panel of daily market data as aligned date x symbol arrays.
+"""
+
+import numpy as np
+import pandas
+from utils.market_tick import MarketTick
+
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'close_return']
+
+
+class MarketPanel:
+    """
+    Daily market data of many symbols as aligned 2-D NumPy arrays, rows are dates and columns are symbols.
+    open / high / low / close / volume / close_return hold NaN where valid is False, i.e. the symbol has no bar that
+    date. close_return is the close to close return from the symbol's previous bar.
+    adj_close is the source's adjusted close where it has one (e.g. yfinance 'Adj Close'), NaN otherwise.
+    Panels out of cleanseMarketPanel also carry the CLEANSE_* provenance bitmask and the price adjustment factor.
+    """
+    def __init__(self, dates, symbols, open, high, low, close, volume, close_return, valid, adj_close=None,
+                 provenance=None, adjustment=None):
+        self.dates = dates
+        self.symbols = symbols
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.close_return = close_return
+        self.valid = valid
+        self.adj_close = adj_close if adj_close is not None else np.full(close.shape, np.nan)
+        self.provenance = provenance
+        self.adjustment = adjustment
+        self.symbolIndex = dict((symbol, j) for j, symbol in enumerate(symbols))
+
+    def __str__(self):
+        return 'MarketPanel<dates={} to {} x {}, symbols={}>'.format(
+            self.dates[0] if len(self.dates) else None, self.dates[-1] if len(self.dates) else None,
+            len(self.dates), len(self.symbols))
+
+    @classmethod
+    def fromSymbolData(cls, symbolData, dates):
+        """
+        Build the panel from DataHub's {symbol: DataFrame} by reindexing every symbol onto dates at once,
+        instead of looking bars up one (date, symbol) at a time.
+        :param symbolData: {symbol: DataFrame}, columns are either plain names or yfinance (Price, Ticker)
+        :param dates: pandas.DatetimeIndex of the panel rows
+        """
+        symbols = list(symbolData.keys())
+        arrays = dict((field, np.full((len(dates), len(symbols)), np.nan)) for field in PANEL_FIELDS)
+        valid = np.zeros((len(dates), len(symbols)), dtype=bool)
+        adjClose = np.full((len(dates), len(symbols)), np.nan)
+
+        for j, symbol in enumerate(symbols):
+            df = symbolData[symbol]
+            columns = df.columns.get_level_values(0) if isinstance(df.columns, pandas.MultiIndex) else df.columns
+            df = pandas.DataFrame(df.to_numpy(dtype=np.float64), index=df.index, columns=columns)
+            df['close_return'] = df['Close'].pct_change(1)
+            aligned = df.reindex(dates)
+            for field, column in zip(PANEL_FIELDS, ['Open', 'High', 'Low', 'Close', 'Volume', 'close_return']):
+                arrays[field][:, j] = aligned[column].to_numpy()
+            if 'Adj Close' in aligned:
+                adjClose[:, j] = aligned['Adj Close'].to_numpy()
+            valid[:, j] = dates.isin(df.index)
+
+        return cls(dates, symbols, valid=valid, adj_close=adjClose, **arrays)
+
+    def getMarketTicks(self, i):
+        """Return {symbol: MarketTick} of the symbols with a bar on the i-th date, i is also the tick's dt_ordinal"""
+        dtIdx = self.dates[i]
+        columns = np.flatnonzero(self.valid[i])
+        open, close, high, low, volume, closeReturn = (
+            values[i, columns] for values in (self.open, self.close, self.high, self.low, self.volume,
+                                              self.close_return))
+        marketTicks = dict()
+        for k, j in enumerate(columns):
+            symbol = self.symbols[j]
+            marketTicks[symbol] = MarketTick(symbol, open[k], close[k], high[k], low[k], volume[k], closeReturn[k],
+                                             dtIdx, i)
+        return marketTicks
+
+    def toDailyMarketTicks(self):
+        """Dictionary representation {date: {symbol: market_tick}}, as DataHub.getDailyMarketTicks"""
+        return dict((self.dates[i], self.getMarketTicks(i)) for i in range(len(self.dates)))
@@ -0,0 +1,106 @@
+"""
+Id:             market_replay.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Day by day replay of a MarketPanel, for backtests.
+"""
+
+import queue
+import threading
+import pandas
+
+# Producer thread marker of the end of the replay
+_END = object()
+
+
+class MarketReplay:
+    """
+    Iterate a MarketPanel one trading day at a time, yielding (dt_idx, {symbol: MarketTick}) like the items of
+    DataHub.getDailyMarketTicks, but only building the ticks of the day being replayed.
+    prefetch > 0 builds up to prefetch days ahead on a background thread, in a bounded queue, so memory stays flat.
+    window(lookback) gives the strategy the history up to the day being replayed and never beyond it, whatever
+    was prefetched.
+    """
+    def __init__(self, panel, startDate=None, endDate=None, prefetch=0):
+        self.panel = panel
+        dates = panel.dates
+        self.start = 0 if startDate is None else dates.searchsorted(pandas.Timestamp(startDate), side='left')
+        self.end = len(dates) if endDate is None else dates.searchsorted(pandas.Timestamp(endDate), side='right')
+        self.prefetch = prefetch
+        # Panel row of the day last handed to the consumer, None before the replay starts
+        self.position = None
+
+    def __str__(self):
+        return 'MarketReplay<days={}, symbols={}, prefetch={}, position={}>'.format(
+            self.end - self.start, len(self.panel.symbols), self.prefetch, self.position)
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def dates(self):
+        """Trading calendar of the replay"""
+        return list(self.panel.dates[self.start:self.end])
+
+    def __iter__(self):
+        days = self._produce() if self.prefetch <= 0 else self._prefetched()
+        for i, dtIdx, marketTicks in days:
+            self.position = i
+            yield dtIdx, marketTicks
+
+    def _produce(self):
+        for i in range(self.start, self.end):
+            yield i, self.panel.dates[i], self.panel.getMarketTicks(i)
+
+    def _prefetched(self):
+        buffer = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            """Time out regularly so the thread exits if the consumer stops early, False once it has"""
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def producer():
+            try:
+                for day in self._produce():
+                    if not put(day):
+                        return
+                put(_END)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=producer, name='MarketReplay', daemon=True)
+        thread.start()
+        try:
+            while True:
+                day = buffer.get()
+                if day is _END:
+                    break
+                if isinstance(day, Exception):
+                    raise day
+                yield day
+        finally:
+            stop.set()
+            thread.join()
+
+    def window(self, lookback):
+        """
+        Lookahead free history: {field: array} of the last lookback days up to and including the day being
+        replayed, rows are dates and columns are panel.symbols, plus 'dates' and 'valid'.
+        """
+        if self.position is None:
+            raise RuntimeError('MarketReplay: window: replay has not started')
+        lo = max(self.start, self.position + 1 - lookback)
+        hi = self.position + 1
+        panel = self.panel
+        window = {'dates': panel.dates[lo:hi]}
+        for field in ['open', 'high', 'low', 'close', 'volume', 'close_return', 'valid']:
+            values = getattr(panel, field)[lo:hi]
+            values.flags.writeable = False
+            window[field] = values
+        return window
@@ -3,8 +3,12 @@ class MarketTick:
     """
     MarketTick is symbol specific, which simulates the real-time market data tick.
     In reality, different symbols may tick at different time.
+    __slots__ keeps ticks compact, there is one per symbol per day. dt_ordinal is the optional integer position of
+    dt_idx in the trading calendar, e.g. the MarketPanel row.
     """
-    def __init__(self, symbol, open, close, high, low, volume, close_return, dt_idx):
+    __slots__ = ('symbol', 'open', 'close', 'high', 'low', 'volume', 'close_return', 'dt_idx', 'dt_ordinal')
+
+    def __init__(self, symbol, open, close, high, low, volume, close_return, dt_idx, dt_ordinal=None):
         self.symbol = symbol
         self.open = open
         self.close = close
@@ -13,6 +17,7 @@ class MarketTick:
         self.volume = volume
         self.close_return = close_return
         self.dt_idx = dt_idx
+        self.dt_ordinal = dt_ordinal
 
     def __str__(self):
         return 'MarketTick<symbol={}, open={}, close={}, high={}, low={}, volume={}, close_return={} dt_idx={}>'.format(
@@ -0,0 +1,187 @@
+"""
+Id:             monte_carlo.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Monte Carlo utility functions.
+"""
+
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+
+class MonteCarloAccumulator:
+    """
+    Streaming mean / variance of Monte Carlo samples, fed chunk by chunk so memory does not grow with path count.
+    Chunks are merged with Chan's parallel update of (count, mean, M2), which is the numerically stable form of
+    accumulating sum and sum of squares.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def __str__(self):
+        return 'MonteCarloAccumulator<count={}, mean={}, standardError={}>'.format(
+            self.count, self.mean, self.standardError())
+
+    def add(self, samples):
+        """Add a chunk of samples"""
+        samples = np.asarray(samples, dtype=float)
+        count = samples.size
+        if count == 0:
+            return
+        mean = samples.mean()
+        m2 = np.dot(samples - mean, samples - mean)
+        self._merge(count, mean, m2)
+
+    def merge(self, other):
+        """Merge the samples accumulated by another accumulator, e.g. from another worker"""
+        if other.count:
+            self._merge(other.count, other.mean, other.m2)
+
+    def _merge(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def estimate(self):
+        """Monte Carlo estimate, i.e. the sample mean"""
+        return self.mean
+
+    def variance(self):
+        """Sample variance, with one degree of freedom"""
+        return self.m2 / (self.count - 1) if self.count > 1 else float('nan')
+
+    def standardError(self):
+        """Standard error of the mean"""
+        return np.sqrt(self.variance() / self.count) if self.count > 1 else float('nan')
+
+    def confidenceHalfWidth(self, confidence=0.95):
+        """Half width of the normal confidence interval around the mean"""
+        return ndtri(0.5 + confidence / 2.0) * self.standardError()
+
+
+class ControlVariateAccumulator:
+    """
+    Streaming control variate estimator. Accumulates (count, means, co-moments) of the target samples and of the
+    control samples with known expectation, merged chunk by chunk as in MonteCarloAccumulator.
+    The optimal coefficient beta = Cov(control, target) / Var(control) is applied at the end, so no second pass over
+    the samples is needed.
+    """
+    def __init__(self, controlMean):
+        self.controlMean = controlMean
+        self.count = 0
+        self.meanTarget = 0.0
+        self.meanControl = 0.0
+        self.m2Target = 0.0
+        self.m2Control = 0.0
+        self.coMoment = 0.0
+
+    def __str__(self):
+        return 'ControlVariateAccumulator<count={}, estimate={}, beta={}, standardError={}>'.format(
+            self.count, self.estimate(), self.beta(), self.standardError())
+
+    def add(self, targets, controls):
+        """Add a chunk of target samples and the matching control samples"""
+        targets = np.asarray(targets, dtype=float)
+        controls = np.asarray(controls, dtype=float)
+        count = targets.size
+        if count == 0:
+            return
+        meanTarget = targets.mean()
+        meanControl = controls.mean()
+        targetDeviation = targets - meanTarget
+        controlDeviation = controls - meanControl
+        self._merge(count, meanTarget, meanControl, np.dot(targetDeviation, targetDeviation),
+                    np.dot(controlDeviation, controlDeviation), np.dot(targetDeviation, controlDeviation))
+
+    def merge(self, other):
+        """Merge the samples accumulated by another accumulator, e.g. from another worker"""
+        if other.count:
+            self._merge(other.count, other.meanTarget, other.meanControl, other.m2Target, other.m2Control,
+                        other.coMoment)
+
+    def _merge(self, count, meanTarget, meanControl, m2Target, m2Control, coMoment):
+        total = self.count + count
+        deltaTarget = meanTarget - self.meanTarget
+        deltaControl = meanControl - self.meanControl
+        weight = self.count * count / total
+        self.meanTarget += deltaTarget * count / total
+        self.meanControl += deltaControl * count / total
+        self.m2Target += m2Target + deltaTarget ** 2 * weight
+        self.m2Control += m2Control + deltaControl ** 2 * weight
+        self.coMoment += coMoment + deltaTarget * deltaControl * weight
+        self.count = total
+
+    def beta(self):
+        """Optimal control variate coefficient"""
+        return self.coMoment / self.m2Control if self.m2Control > 0 else 0.0
+
+    def estimate(self):
+        """Control variate estimate of the target mean"""
+        return self.meanTarget - self.beta() * (self.meanControl - self.controlMean)
+
+    def variance(self):
+        """Residual variance of the target after regressing out the control"""
+        if self.count < 3:
+            return float('nan')
+        return (self.m2Target - self.beta() * self.coMoment) / (self.count - 2)
+
+    def standardError(self):
+        """Standard error of the control variate estimate"""
+        return np.sqrt(self.variance() / self.count) if self.count > 2 else float('nan')
+
+    def confidenceHalfWidth(self, confidence=0.95):
+        """Half width of the normal confidence interval around the estimate"""
+        return ndtri(0.5 + confidence / 2.0) * self.standardError()
+
+
+def sobolNormals(sampler, size):
+    """
+    Draw size points of the scipy qmc.Sobol sampler, mapped to standard normals by inverse cdf.
+    Return an array of shape (size, sampler.d). Sizes which are powers of 2 keep the sequence balanced.
+    """
+    uniforms = sampler.random(size)
+    # Scrambled points never hit 0 or 1, clip anyway so that the inverse cdf stays finite
+    return ndtri(np.clip(uniforms, 1.0e-12, 1.0 - 1.0e-12))
+
+
+def newSobolSampler(dimension, seed=None):
+    """Scrambled Sobol sampler of given dimension"""
+    return qmc.Sobol(d=dimension, scramble=True, seed=seed)
+
+
+def gbmPathBlocks(rng, paths, spot, rate, sigma, tenor, steps, stepBlock=64, dtype=np.float64):
+    """
+    Generate geometric Brownian motion paths as consecutive blocks of time steps, so the full (paths x steps)
+    matrix never exists in memory. Each block is a (paths x stepBlock) array of prices at the next time steps
+    (the last block may be narrower), written in place into a reused buffer: consumers must reduce a block
+    before asking for the next one. Log returns are summed cumulatively in place and carried across blocks.
+    dtype=np.float32 halves memory and bandwidth, at the cost of precision on long paths.
+    """
+    deltaT = float(tenor) / steps
+    drift = (rate - 0.5 * sigma ** 2) * deltaT
+    diffusion = sigma * np.sqrt(deltaT)
+    buffer = np.empty((paths, min(stepBlock, steps)), dtype=dtype)
+    # Log of price over spot at the end of the previous block
+    carry = np.zeros(paths, dtype=dtype)
+
+    done = 0
+    while done < steps:
+        width = min(stepBlock, steps - done)
+        if width != buffer.shape[1]:
+            # Only the last block can be narrower, the generator fills contiguous arrays only
+            buffer = np.empty((paths, width), dtype=dtype)
+        block = buffer
+        rng.standard_normal(dtype=dtype, out=block)
+        block *= diffusion
+        block += drift
+        block[:, 0] += carry
+        np.cumsum(block, axis=1, out=block)
+        carry[:] = block[:, -1]
+        np.exp(block, out=block)
+        block *= spot
+        done += width
+        yield block
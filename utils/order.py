@@ -42,6 +42,8 @@ class Order:
         # Order executable period (inclusive). None means no bound.
         self.valid_from_dt_idx = valid_from_dt_idx
         self.valid_to_dt_idx = valid_to_dt_idx
+        # Notified with on_order_state_changed(order, previous_state) after every fill / cancel, e.g. OrderBook
+        self.observers = []
 
     def __str__(self):
         return 'Order<order_id={}, symbol={}, direction={}, type={}, price={}, pct_from_market={}, fill_price={}, ' \
@@ -61,6 +63,7 @@ class Order:
     def fill(self, fill_price, quantity, datetime):
         logging.info('Order: fill: BEFORE: order={} CHANGE: fill_price={}, quantity={}, datetime={}'.format(
             self, fill_price, quantity, datetime))
+        previous_state = self.state
         if quantity > self.quantity_outstanding or quantity <= 0:
             logging.error('Order: fill: order_id={} Invalid quantity={}!'.format(self.order_id, quantity))
             raise Exception()
@@ -75,9 +78,16 @@ class Order:
             self.calculate_commission()
         logging.info('Order: fill: AFTER: order={} CHANGE: fill_price={}, quantity={}, datetime={}'.format(
             self, fill_price, quantity, datetime))
+        self._notify(previous_state)
 
     def cancel(self, datetime):
         logging.info('Order: cancel: BEFORE: order={} CHANGE: datetime={}'.format(self, datetime))
+        previous_state = self.state
         self.state = ORDER_STATE_CANCELLED
         self.close_dt_idx = datetime
         logging.info('Order: cancel: AFTER: order={} CHANGE: datetime={}'.format(self, datetime))
+        self._notify(previous_state)
+
+    def _notify(self, previous_state):
+        for observer in self.observers:
+            observer.on_order_state_changed(self, previous_state)
@@ -0,0 +1,138 @@
+import logging
+import datetime
+from utils.order import ORDER_STATE_NEW, ORDER_STATE_PARTIALLY_FILLED, ORDER_STATE_FULLY_FILLED, \
+    ORDER_STATE_CANCELLED, ORDER_TYPE_MARKET, ORDER_TYPE_LIMIT, ORDER_TYPE_STOP
+
+ORDER_STATE_GROUPS = {
+    ORDER_STATE_NEW: 'outstanding',
+    ORDER_STATE_PARTIALLY_FILLED: 'outstanding',
+    ORDER_STATE_FULLY_FILLED: 'filled',
+    ORDER_STATE_CANCELLED: 'cancelled',
+}
+ORDER_TYPES = [ORDER_TYPE_MARKET, ORDER_TYPE_STOP, ORDER_TYPE_LIMIT]
+
+
+class SymbolOrderStatistics:
+    """
+    Order counts of a symbol by state group (outstanding, filled, cancelled) and type, and the total trade life of
+    filled stop / limit orders, kept up to date on every order placed and every state transition.
+    """
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.counts = dict(((group, type), 0)
+                           for group in ['outstanding', 'filled', 'cancelled'] for type in ORDER_TYPES)
+        self.total_trade_life = datetime.timedelta()
+        # order_id: trade life counted for the order, taken back if it ever leaves FULLY_FILLED
+        self.trade_lives = dict()
+
+    def __str__(self):
+        return 'SymbolOrderStatistics<symbol={}, counts={}, total_trade_life={}>'.format(
+            self.symbol, self.counts, self.total_trade_life)
+
+    def get(self, group, type):
+        return self.counts[(group, type)]
+
+    def add(self, order):
+        self._count(order, order.state, 1)
+
+    def transition(self, order, previous_state):
+        if ORDER_STATE_GROUPS.get(previous_state) == ORDER_STATE_GROUPS.get(order.state):
+            return
+        self._count(order, previous_state, -1)
+        self._count(order, order.state, 1)
+
+    def _count(self, order, state, increment):
+        group = ORDER_STATE_GROUPS.get(state)
+        if group is None or order.type not in ORDER_TYPES:
+            return
+        self.counts[(group, order.type)] += increment
+        if group == 'filled' and order.type in [ORDER_TYPE_STOP, ORDER_TYPE_LIMIT]:
+            if increment > 0:
+                trade_life = order.close_dt_idx.to_pydatetime() - order.open_dt_idx.to_pydatetime()
+                self.trade_lives[order.order_id] = trade_life
+                self.total_trade_life += trade_life
+            else:
+                self.total_trade_life -= self.trade_lives.pop(order.order_id)
+
+
+class OrderBook:
+    """
+    Store of all orders placed, with hash indexes by order_id, link_id and symbol.
+    Live orders (NEW or PARTIALLY_FILLED) are also kept per symbol in an active set, terminal orders (FULLY_FILLED or
+    CANCELLED) move to the archive as soon as Order.fill / Order.cancel notify the book, so execution only walks live
+    orders. Iterating the book gives every order in placing order, as the former list of orders.
+    Per symbol order statistics are maintained on the same notifications, see SymbolOrderStatistics.
+    """
+    def __init__(self):
+        self.orders = dict()
+        self.orders_by_symbol = dict()
+        self.orders_by_link_id = dict()
+        # symbol: {order_id: order} of live orders, in placing order
+        self.active_orders_by_symbol = dict()
+        self.archive = dict()
+        # symbol: SymbolOrderStatistics
+        self.statistics = dict()
+
+    def __str__(self):
+        return 'OrderBook<orders={}, active={}, archived={}>'.format(
+            len(self.orders), len(self.orders) - len(self.archive), len(self.archive))
+
+    def __iter__(self):
+        return iter(self.orders.values())
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, order):
+        self.orders[order.order_id] = order
+        self.orders_by_symbol.setdefault(order.symbol, []).append(order)
+        if order.link_id is not None:
+            self.orders_by_link_id.setdefault(order.link_id, []).append(order)
+        if order.state in [ORDER_STATE_NEW, ORDER_STATE_PARTIALLY_FILLED]:
+            self.active_orders_by_symbol.setdefault(order.symbol, dict())[order.order_id] = order
+        else:
+            self.archive[order.order_id] = order
+        if order.symbol not in self.statistics:
+            self.statistics[order.symbol] = SymbolOrderStatistics(order.symbol)
+        self.statistics[order.symbol].add(order)
+        order.observers.append(self)
+
+    def link(self, orders, link_id):
+        """Set link_id on the orders and index them by it"""
+        for order in orders:
+            if order.link_id is not None and order.link_id in self.orders_by_link_id:
+                self.orders_by_link_id[order.link_id].remove(order)
+            order.link_id = link_id
+            if order.order_id in self.orders:
+                self.orders_by_link_id.setdefault(link_id, []).append(order)
+
+    def on_order_state_changed(self, order, previous_state):
+        """Observer hook of Order.fill / Order.cancel"""
+        self.statistics[order.symbol].transition(order, previous_state)
+        if order.state in [ORDER_STATE_NEW, ORDER_STATE_PARTIALLY_FILLED]:
+            return
+        active_orders = self.active_orders_by_symbol.get(order.symbol, dict())
+        if active_orders.pop(order.order_id, None) is not None:
+            self.archive[order.order_id] = order
+            logging.debug('OrderBook: on_order_state_changed: Archived order_id={}, state={}'.format(
+                order.order_id, order.state))
+
+    def get_order_by_order_id(self, order_id):
+        return self.orders.get(order_id)
+
+    def get_orders_by_link_id(self, link_id):
+        return list(self.orders_by_link_id.get(link_id, []))
+
+    def get_orders_by_symbol(self, symbol):
+        return list(self.orders_by_symbol.get(symbol, []))
+
+    def get_active_orders_by_symbol(self, symbol):
+        """Live orders of the symbol, as a list so that orders can be filled or cancelled while walking it"""
+        return list(self.active_orders_by_symbol.get(symbol, dict()).values())
+
+    def get_statistics(self, symbol):
+        """SymbolOrderStatistics of the symbol, None if it has no order"""
+        return self.statistics.get(symbol)
+
+    def get_all_symbols(self):
+        return list(self.orders_by_symbol.keys())
@@ -0,0 +1,101 @@
+"""
+Id:             path_payoffs.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Path dependent option pay offs, reduced block by block from simulated paths.
+"""
+
+import numpy as np
+
+
+class PathPayOff:
+    """
+    Pay off reducer for path dependent options.
+    The reducer itself is stateless, so one instance can be shared by worker threads / processes.
+    newState creates the running per-path state for a chunk of paths, update folds a (paths x steps) block of
+    prices into it, payOffs turns the final state into one pay off per path.
+    """
+    def newState(self, paths, spot):
+        return dict()
+
+    def update(self, state, prices):
+        pass
+
+    def payOffs(self, state, terminal, callPut, strike):
+        raise NotImplementedError()
+
+
+class AsianPayOff(PathPayOff):
+    """Arithmetic average price option, averaging over all simulated time steps"""
+    def __str__(self):
+        return 'AsianPayOff<>'
+
+    def newState(self, paths, spot):
+        return {'sum': np.zeros(paths), 'count': 0}
+
+    def update(self, state, prices):
+        state['sum'] += prices.sum(axis=1, dtype=np.float64)
+        state['count'] += prices.shape[1]
+
+    def payOffs(self, state, terminal, callPut, strike):
+        average = state['sum'] / state['count']
+        if callPut == 'Call':
+            return np.maximum(average - strike, 0.0)
+        elif callPut == 'Put':
+            return np.maximum(strike - average, 0.0)
+
+
+class BarrierPayOff(PathPayOff):
+    """
+    Vanilla pay off knocked in / out by a barrier monitored at every time step.
+    barrierType: 'up-and-out', 'up-and-in', 'down-and-out' or 'down-and-in'
+    """
+    def __init__(self, barrier, barrierType='up-and-out'):
+        self.barrier = barrier
+        self.barrierType = barrierType
+
+    def __str__(self):
+        return 'BarrierPayOff<barrier={}, barrierType={}>'.format(self.barrier, self.barrierType)
+
+    def newState(self, paths, spot):
+        hit = spot >= self.barrier if self.barrierType.startswith('up') else spot <= self.barrier
+        return {'hit': np.full(paths, hit)}
+
+    def update(self, state, prices):
+        if self.barrierType.startswith('up'):
+            state['hit'] |= prices.max(axis=1) >= self.barrier
+        else:
+            state['hit'] |= prices.min(axis=1) <= self.barrier
+
+    def payOffs(self, state, terminal, callPut, strike):
+        if callPut == 'Call':
+            vanilla = np.maximum(terminal - strike, 0.0)
+        elif callPut == 'Put':
+            vanilla = np.maximum(strike - terminal, 0.0)
+        alive = ~state['hit'] if self.barrierType.endswith('out') else state['hit']
+        return np.where(alive, vanilla, 0.0)
+
+
+class LookbackPayOff(PathPayOff):
+    """
+    Lookback option on the running max / min, including the spot at inception.
+    floating=True: call pays s_T - min, put pays max - s_T, strike is ignored.
+    floating=False: call pays max - strike, put pays strike - min.
+    """
+    def __init__(self, floating=True):
+        self.floating = floating
+
+    def __str__(self):
+        return 'LookbackPayOff<floating={}>'.format(self.floating)
+
+    def newState(self, paths, spot):
+        return {'max': np.full(paths, float(spot)), 'min': np.full(paths, float(spot))}
+
+    def update(self, state, prices):
+        np.maximum(state['max'], prices.max(axis=1), out=state['max'])
+        np.minimum(state['min'], prices.min(axis=1), out=state['min'])
+
+    def payOffs(self, state, terminal, callPut, strike):
+        if callPut == 'Call':
+            return terminal - state['min'] if self.floating else np.maximum(state['max'] - strike, 0.0)
+        elif callPut == 'Put':
+            return state['max'] - terminal if self.floating else np.maximum(strike - state['min'], 0.0)
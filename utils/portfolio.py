@@ -1,7 +1,16 @@
 
+import logging
+
+# Absolute tolerance of verify, between running totals and a full recompute
+CONSISTENCY_TOLERANCE = 1e-6
+
+
 class Portfolio:
     """
     Aggregation of Positions
+    Totals are kept running: positions passed to track() notify every change as deltas, so the portfolio is up to
+    date without summing all positions again. refresh() still recomputes from scratch, verify() checks the running
+    totals against it.
     """
     def __init__(self, capital):
         self.initial_capital = capital
@@ -29,3 +38,25 @@ class Portfolio:
             self.cash_balance += (position.realized_pnl - position.cost)
             self.position_cost += position.cost
             self.position_mtm += position.mtm
+
+    def track(self, position):
+        """Follow the changes of a position, which must not be included in the totals yet"""
+        position.observers.append(self)
+        self.on_position_changed(position, position.realized_pnl, position.cost, position.mtm)
+
+    def on_position_changed(self, position, realized_pnl_delta, cost_delta, mtm_delta):
+        """Observer hook of Position.change / Position.update_mtm"""
+        self.realized_pnl += realized_pnl_delta
+        self.cash_balance += (realized_pnl_delta - cost_delta)
+        self.position_cost += cost_delta
+        self.position_mtm += mtm_delta
+
+    def verify(self, positions):
+        """Check the running totals against a full recompute from the positions, raise if they diverge"""
+        expected = Portfolio(self.initial_capital)
+        expected.refresh(positions)
+        for attribute in ['realized_pnl', 'cash_balance', 'position_cost', 'position_mtm']:
+            if abs(getattr(self, attribute) - getattr(expected, attribute)) > CONSISTENCY_TOLERANCE:
+                logging.error('Portfolio: verify: {} running total={} but recomputed={}'.format(
+                    attribute, getattr(self, attribute), getattr(expected, attribute)))
+                raise Exception()
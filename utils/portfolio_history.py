@@ -0,0 +1,90 @@
+import math
+import numpy as np
+import pandas
+
+PORTFOLIO_HISTORY_COLUMNS = ['cash_balance', 'position_mtm', 'position_cost', 'realized_pnl']
+
+
+class PortfolioHistory:
+    """
+    Daily end of day Portfolio values, stored column by column in NumPy arrays grown by doubling, so that appending a
+    day is amortized O(1) and no Portfolio copy is kept.
+    The daily returns of the portfolio value (position_mtm + cash_balance) are accumulated as they come (Welford), so
+    annualized return / volatility and Sharpe ratio are O(1) per day, matching performance_evaluation on the whole
+    series.
+    """
+    def __init__(self, capacity=256):
+        self.size = 0
+        self.dates = np.empty(capacity, dtype='datetime64[ns]')
+        self.columns = dict((column, np.empty(capacity)) for column in PORTFOLIO_HISTORY_COLUMNS)
+        # Daily returns: count, mean and sum of squared deviations
+        self.return_count = 0
+        self.return_mean = 0.0
+        self.return_m2 = 0.0
+
+    def __str__(self):
+        return 'PortfolioHistory<days={}, annualized_return={}, annualized_volatility={}>'.format(
+            self.size, self.annualized_return(), self.annualized_volatility())
+
+    def __len__(self):
+        return self.size
+
+    def append(self, portfolio, dt_idx=None):
+        """Record the portfolio values of a day, dt_idx None records NaT"""
+        if self.size == self.dates.size:
+            self._grow()
+        previous_value = None
+        if self.size:
+            previous_value = self.columns['position_mtm'][self.size - 1] + self.columns['cash_balance'][self.size - 1]
+
+        self.dates[self.size] = np.datetime64('NaT') if dt_idx is None else pandas.Timestamp(dt_idx).to_datetime64()
+        for column in PORTFOLIO_HISTORY_COLUMNS:
+            self.columns[column][self.size] = getattr(portfolio, column)
+        self.size += 1
+
+        if previous_value is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                daily_return = np.float64(portfolio.position_mtm + portfolio.cash_balance) / previous_value - 1.0
+            # pct_change().dropna() skips NaN returns only
+            if not math.isnan(daily_return):
+                self.return_count += 1
+                delta = daily_return - self.return_mean
+                self.return_mean += delta / self.return_count
+                self.return_m2 += delta * (daily_return - self.return_mean)
+
+    def _grow(self):
+        capacity = 2 * self.dates.size
+        self.dates = np.resize(self.dates, capacity)
+        for column in PORTFOLIO_HISTORY_COLUMNS:
+            self.columns[column] = np.resize(self.columns[column], capacity)
+
+    def get(self, column):
+        """Values of a column so far, as a read only view"""
+        values = self.columns[column][:self.size]
+        values.flags.writeable = False
+        return values
+
+    def values(self):
+        """Daily portfolio values, position_mtm + cash_balance"""
+        return self.columns['position_mtm'][:self.size] + self.columns['cash_balance'][:self.size]
+
+    def annualized_return(self, n=255):
+        return self.return_mean * n if self.return_count else float('nan')
+
+    def annualized_volatility(self, n=255):
+        if self.return_count < 2:
+            return float('nan')
+        return math.sqrt(self.return_m2 / (self.return_count - 1)) * math.sqrt(n)
+
+    def sharpe_ratio(self, n=255, risk_free=0.0017625):
+        sigma = self.annualized_volatility(n)
+        return (self.annualized_return(n) - risk_free) / sigma if sigma > 0 else float('nan')
+
+    def to_frame(self):
+        """DataFrame of the history, indexed by date"""
+        data = dict((column, self.columns[column][:self.size].copy()) for column in PORTFOLIO_HISTORY_COLUMNS)
+        return pandas.DataFrame(data, index=pandas.DatetimeIndex(self.dates[:self.size].copy(), name='Date'))
+
+    def to_parquet(self, path):
+        """Export for post run analysis, needs pyarrow or fastparquet"""
+        self.to_frame().to_parquet(path)
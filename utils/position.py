@@ -9,6 +9,8 @@ class Position:
         self.cost = 0
         self.realized_pnl = 0
         self.mtm = 0
+        # Notified with on_position_changed(position, realized_pnl_delta, cost_delta, mtm_delta), e.g. Portfolio
+        self.observers = []
 
     def __str__(self):
         return 'Position<symbol={}, quantity={}, cost={}, mtm={}, realized_pnl={}>'.format(
@@ -18,6 +20,7 @@ class Position:
         """Position change should ONLY be triggered by order execution"""
         logging.info('Position: BEFORE: position={} CHANGE: price={}, quantity={}, commission={}'.format(
             self, price, quantity, commission))
+        realized_pnl, cost = self.realized_pnl, self.cost
         if quantity == 0:
             logging.error('Position: change: symbol={} Invalid quantity is 0'.format(self.symbol))
             raise Exception()
@@ -32,10 +35,17 @@ class Position:
             self.quantity += quantity
         logging.info('Position: AFTER: position={} CHANGE: price={}, quantity={}, commission={}'.format(
             self, price, quantity, commission))
+        self._notify(self.realized_pnl - realized_pnl, self.cost - cost, 0)
 
     def update_mtm(self, price):
         """Update Position mtm based on given price marker"""
         #logging.info('Position mtm: BEFORE: position={} price={}'.format(self, price))
+        mtm = self.mtm
         self.mtm = self.quantity * price
         #logging.info('Position mtm: AFTER: position={} price={}'.format(self, price))
+        self._notify(0, 0, self.mtm - mtm)
+
+    def _notify(self, realized_pnl_delta, cost_delta, mtm_delta):
+        for observer in self.observers:
+            observer.on_position_changed(self, realized_pnl_delta, cost_delta, mtm_delta)
 
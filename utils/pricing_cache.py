@@ -0,0 +1,150 @@
+"""
+Id:             pricing_cache.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Pricing cache, memoizing repeated option pricing calls.
+"""
+
+import logging
+from collections import OrderedDict
+import numpy as np
+from utils.black_scholes import blackScholesOptionPrice
+from utils.binomial_tree import binomialTree
+
+
+def binomialTreePricer(N=2000, american=True, scheme='CRR'):
+    """Wrap binomialTree into the blackScholesOptionPrice argument order, for use in PricingCache"""
+    def pricer(callPut, spot, strike, tenor, rate, sigma):
+        return binomialTree(callPut, spot, strike, rate, sigma, tenor, N=N, american=american, scheme=scheme)
+    return pricer
+
+
+class PricingGrid:
+    """
+    Prices of one contract (callPut, strike, tenor, rate) on a spot x sigma grid, interpolated bilinearly.
+    maxError is the largest interpolation error measured at the cell centres when the grid was built.
+    """
+    def __init__(self, spots, sigmas, prices, maxError):
+        self.spots = spots
+        self.sigmas = sigmas
+        self.prices = prices
+        self.maxError = maxError
+
+    def __str__(self):
+        return 'PricingGrid<spots=[{}, {}] x {}, sigmas=[{}, {}] x {}, maxError={}>'.format(
+            self.spots[0], self.spots[-1], self.spots.size, self.sigmas[0], self.sigmas[-1], self.sigmas.size,
+            self.maxError)
+
+    def contains(self, spot, sigma):
+        return self.spots[0] <= spot <= self.spots[-1] and self.sigmas[0] <= sigma <= self.sigmas[-1]
+
+    def interpolate(self, spot, sigma):
+        """Bilinear interpolation, spot and sigma can be scalars or arrays within the grid"""
+        i = np.clip(np.searchsorted(self.spots, spot, side='right') - 1, 0, self.spots.size - 2)
+        j = np.clip(np.searchsorted(self.sigmas, sigma, side='right') - 1, 0, self.sigmas.size - 2)
+        x = (spot - self.spots[i]) / (self.spots[i + 1] - self.spots[i])
+        y = (sigma - self.sigmas[j]) / (self.sigmas[j + 1] - self.sigmas[j])
+        return (self.prices[i, j] * (1 - x) * (1 - y) + self.prices[i + 1, j] * x * (1 - y) +
+                self.prices[i, j + 1] * (1 - x) * y + self.prices[i + 1, j + 1] * x * y)
+
+
+class PricingCache:
+    """
+    Memoize pricer(callPut, spot, strike, tenor, rate, sigma) calls, e.g. blackScholesOptionPrice or
+    binomialTreePricer(...).
+    Exact calls are kept in a bounded LRU, the least recently used one is evicted beyond maxSize entries.
+    Contracts with a precomputed spot / sigma grid are served by interpolation for any spot and sigma inside it.
+    Counters: hits (exact), interpolations (grid), misses (pricer called), evictions.
+    """
+    def __init__(self, pricer=blackScholesOptionPrice, maxSize=100000):
+        self.pricer = pricer
+        self.maxSize = maxSize
+        self.prices = OrderedDict()
+        self.grids = dict()
+        self.hits = 0
+        self.interpolations = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return 'PricingCache<size={}, grids={}, hits={}, interpolations={}, misses={}, evictions={}>'.format(
+            len(self.prices), len(self.grids), self.hits, self.interpolations, self.misses, self.evictions)
+
+    def price(self, callPut, spot, strike, tenor, rate, sigma):
+        key = (callPut, spot, strike, tenor, rate, sigma)
+        price = self.prices.get(key)
+        if price is not None:
+            self.hits += 1
+            self.prices.move_to_end(key)
+            return price
+
+        grid = self.grids.get((callPut, strike, tenor, rate))
+        if grid is not None and grid.contains(spot, sigma):
+            self.interpolations += 1
+            return grid.interpolate(spot, sigma)
+
+        self.misses += 1
+        price = self.pricer(callPut, spot, strike, tenor, rate, sigma)
+        self.prices[key] = price
+        if len(self.prices) > self.maxSize:
+            self.prices.popitem(last=False)
+            self.evictions += 1
+        return price
+
+    def precomputeGrid(self, callPut, strike, tenor, rate, spots, sigmas, tolerance=1.0e-3, maxRefinements=3):
+        """
+        Price the contract on the spots x sigmas grid, to serve off-grid queries by interpolation.
+        The interpolation error is measured against the pricer at every cell centre, the grid is refined by
+        halving its cells until the error is within tolerance, at most maxRefinements times.
+        Return the PricingGrid, or None if the tolerance could not be met, in which case queries keep going to the
+        pricer.
+        """
+        spots = np.asarray(spots, dtype=float)
+        sigmas = np.asarray(sigmas, dtype=float)
+        for refinement in range(maxRefinements + 1):
+            prices = self._priceGrid(callPut, strike, tenor, rate, spots, sigmas)
+            grid = PricingGrid(spots, sigmas, prices, 0.0)
+
+            centreSpots = 0.5 * (spots[1:] + spots[:-1])
+            centreSigmas = 0.5 * (sigmas[1:] + sigmas[:-1])
+            exact = self._priceGrid(callPut, strike, tenor, rate, centreSpots, centreSigmas)
+            interpolated = grid.interpolate(centreSpots[:, None], centreSigmas[None, :])
+            grid.maxError = np.max(np.abs(exact - interpolated))
+
+            if grid.maxError <= tolerance:
+                self.grids[(callPut, strike, tenor, rate)] = grid
+                logging.debug('PricingCache: precomputeGrid: refinement={}, grid={}'.format(refinement, grid))
+                return grid
+
+            spots = self._refine(spots)
+            sigmas = self._refine(sigmas)
+
+        logging.warning('PricingCache: precomputeGrid: callPut={}, strike={}, tenor={}, rate={} maxError={} above '
+                        'tolerance={}'.format(callPut, strike, tenor, rate, grid.maxError, tolerance))
+        return None
+
+    def _priceGrid(self, callPut, strike, tenor, rate, spots, sigmas):
+        return np.asarray([[self.pricer(callPut, spot, strike, tenor, rate, sigma) for sigma in sigmas]
+                           for spot in spots], dtype=float)
+
+    @staticmethod
+    def _refine(points):
+        """Insert the midpoint of every interval"""
+        refined = np.empty(2 * points.size - 1)
+        refined[0::2] = points
+        refined[1::2] = 0.5 * (points[1:] + points[:-1])
+        return refined
+
+    def stats(self):
+        return {
+            'size': len(self.prices),
+            'grids': len(self.grids),
+            'hits': self.hits,
+            'interpolations': self.interpolations,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def clear(self):
+        self.prices.clear()
+        self.grids.clear()
+        self.hits = self.interpolations = self.misses = self.evictions = 0
@@ -0,0 +1,100 @@
+"""
+Id:             rolling_window.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Incremental rolling window statistics.
+"""
+
+import math
+from collections import deque
+
+
+class RollingWindow:
+    """
+    Ring buffer of the last period values, with O(1) mean / std (Welford add and remove) and amortized O(1) max / min
+    (monotonic deques). NaN values take a slot of the window but are skipped by the statistics, as pandas does on
+    series[-period:].
+    The running moments are recomputed from the buffer once every period values, so rounding errors of the
+    add / remove updates do not accumulate over long series.
+    """
+    def __init__(self, period):
+        self.period = period
+        self.values = [float('nan')] * period
+        # Number of values appended so far
+        self.count = 0
+        # Non NaN values within the window, and their mean and sum of squared deviations
+        self.n = 0
+        self.mu = 0.0
+        self.m2 = 0.0
+        # (position, value) with decreasing values for max, increasing values for min
+        self.max_deque = deque()
+        self.min_deque = deque()
+
+    def __str__(self):
+        return 'RollingWindow<period={}, count={}, mean={}, std={}, max={}, min={}>'.format(
+            self.period, self.count, self.mean(), self.std(), self.max(), self.min())
+
+    def __len__(self):
+        return min(self.count, self.period)
+
+    def append(self, value):
+        position = self.count
+        slot = position % self.period
+        if position >= self.period:
+            self._remove(self.values[slot])
+        self.values[slot] = value
+        self.count += 1
+
+        if not math.isnan(value):
+            self._add(value)
+            while self.max_deque and self.max_deque[-1][1] <= value:
+                self.max_deque.pop()
+            self.max_deque.append((position, value))
+            while self.min_deque and self.min_deque[-1][1] >= value:
+                self.min_deque.pop()
+            self.min_deque.append((position, value))
+
+        oldest = position - self.period
+        while self.max_deque and self.max_deque[0][0] <= oldest:
+            self.max_deque.popleft()
+        while self.min_deque and self.min_deque[0][0] <= oldest:
+            self.min_deque.popleft()
+
+        if self.count % self.period == 0:
+            self._recompute()
+
+    def _add(self, value):
+        self.n += 1
+        delta = value - self.mu
+        self.mu += delta / self.n
+        self.m2 += delta * (value - self.mu)
+
+    def _remove(self, value):
+        if math.isnan(value):
+            return
+        self.n -= 1
+        if self.n == 0:
+            self.mu = self.m2 = 0.0
+            return
+        delta = value - self.mu
+        self.mu -= delta / self.n
+        self.m2 = max(self.m2 - delta * (value - self.mu), 0.0)
+
+    def _recompute(self):
+        """Two pass mean and sum of squared deviations of the window"""
+        values = [value for value in self.values if not math.isnan(value)]
+        self.n = len(values)
+        self.mu = math.fsum(values) / self.n if self.n else 0.0
+        self.m2 = math.fsum((value - self.mu) ** 2 for value in values)
+
+    def mean(self):
+        return self.mu if self.n > 0 else float('nan')
+
+    def std(self):
+        """Sample standard deviation, with one degree of freedom like pandas"""
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else float('nan')
+
+    def max(self):
+        return self.max_deque[0][1] if self.max_deque else float('nan')
+
+    def min(self):
+        return self.min_deque[0][1] if self.min_deque else float('nan')
@@ -0,0 +1,33 @@
+class SymbolMap:
+    """
+    Items with a symbol attribute (e.g. Position, Performance) keyed by symbol, for O(1) lookup.
+    Keeps the list API its callers iterate on: append, iteration in insertion order, len and truthiness.
+    """
+    def __init__(self, items=()):
+        self.items = dict()
+        for item in items:
+            self.append(item)
+
+    def __str__(self):
+        return 'SymbolMap<symbols={}>'.format(list(self.items.keys()))
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, symbol):
+        return symbol in self.items
+
+    def append(self, item):
+        if item.symbol in self.items:
+            raise ValueError('SymbolMap: append: symbol={} already present'.format(item.symbol))
+        self.items[item.symbol] = item
+
+    def get(self, symbol):
+        """Return the item of the symbol, None if there is none"""
+        return self.items.get(symbol)
+
+    def symbols(self):
+        return list(self.items.keys())
@@ -0,0 +1,84 @@
+"""
+Id:             trading_calendar.py
+Copyright:      2018 xiaokang.guan All rights reserved.
+Description:    Trading calendar, with O(1) date to ordinal lookup and exchange holidays.
+"""
+
+import pandas
+from pandas.tseries.holiday import AbstractHolidayCalendar, Holiday, nearest_workday, sunday_to_monday, \
+    USMartinLutherKingJr, USPresidentsDay, GoodFriday, USMemorialDay, USLaborDay, USThanksgivingDay
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Regular NYSE full day holidays, one-off closures (e.g. national days of mourning) are not included"""
+    rules = [
+        # NYSE does not close on the Friday before a Saturday New Year's Day
+        Holiday('NewYearsDay', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-06-19', observance=nearest_workday),
+        Holiday('IndependenceDay', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ]
+
+
+class TradingCalendar:
+    """
+    Ascending trading dates, with a date -> ordinal hash map so that date lookups and date arithmetic in trading
+    days are O(1), e.g. offset(date, 2) is the trading date two days after date.
+    Supports len(), [ordinal], `date in calendar` and iteration like the sorted list of dates it replaces.
+    """
+    def __init__(self, dates):
+        self.dates = [pandas.Timestamp(date) for date in sorted(set(dates))]
+        self.ordinals = dict((date, i) for i, date in enumerate(self.dates))
+
+    def __str__(self):
+        return 'TradingCalendar<dates={} to {} x {}>'.format(
+            self.dates[0] if self.dates else None, self.dates[-1] if self.dates else None, len(self.dates))
+
+    @classmethod
+    def businessDays(cls, startDate, endDate, holidayCalendar=None, extraDates=()):
+        """
+        Weekdays from startDate to endDate inclusive, less the holidays of holidayCalendar (NYSE by default).
+        extraDates are added back, e.g. the dates a data source actually has bars for.
+        """
+        holidayCalendar = holidayCalendar if holidayCalendar is not None else NYSEHolidayCalendar()
+        holidays = holidayCalendar.holidays(pandas.Timestamp(startDate), pandas.Timestamp(endDate))
+        dates = pandas.bdate_range(startDate, endDate, freq='C', holidays=holidays)
+        return cls(dates.union(pandas.DatetimeIndex(list(extraDates))))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, ordinal):
+        return self.dates[ordinal]
+
+    def __iter__(self):
+        return iter(self.dates)
+
+    def __contains__(self, date):
+        return date in self.ordinals
+
+    def ordinal(self, date):
+        """Position of a trading date in the calendar, KeyError if it is not a trading date"""
+        return self.ordinals[pandas.Timestamp(date)]
+
+    def offset(self, date, n):
+        """Trading date n trading days after date (before if n < 0), IndexError beyond the calendar"""
+        ordinal = self.ordinal(date) + n
+        if not 0 <= ordinal < len(self.dates):
+            raise IndexError('TradingCalendar: offset: {} {:+d} trading days is outside {}'.format(date, n, self))
+        return self.dates[ordinal]
+
+    def range(self, startDate, endDate):
+        """Trading dates from startDate to endDate inclusive, either may fall on a non trading date"""
+        index = pandas.DatetimeIndex(self.dates)
+        return self.dates[index.searchsorted(pandas.Timestamp(startDate), side='left'):
+                          index.searchsorted(pandas.Timestamp(endDate), side='right')]
+
+    def toIndex(self):
+        return pandas.DatetimeIndex(self.dates)
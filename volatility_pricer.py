@@ -8,7 +8,7 @@ import datetime
 
 import numpy as np
 
-from utils.black_scholes import blackScholesSolveImpliedVol
+from utils.black_scholes import blackScholesSolveImpliedVol, blackScholesSolveImpliedVolBatch
 from utils.data_hub import DataHub
 
 
@@ -54,5 +54,13 @@ class VolatilityPricer():
         return self.realizedVolBySymbol
 
     def getImpliedVol(self, optionPrice=17.5, callPut='Call', spot=586.08, strike=585.0, tenor=0.109589, rate=0.0002):
-        """ Calculate the implied volatility from option market price """
-        return blackScholesSolveImpliedVol(optionPrice, callPut, spot, strike, tenor, rate)
\ No newline at end of file
+        """
+        Calculate the implied volatility from option market price.
+        If optionPrice / strike etc. are arrays (e.g. a whole strike ladder), solve the entire smile in one call,
+        quotes which fail to converge come back as NaN.
+        """
+        if all(np.ndim(x) == 0 for x in (optionPrice, callPut, spot, strike, tenor, rate)):
+            return blackScholesSolveImpliedVol(optionPrice, callPut, spot, strike, tenor, rate)
+
+        impliedVols, converged = blackScholesSolveImpliedVolBatch(optionPrice, callPut, spot, strike, tenor, rate)
+        return np.where(converged, impliedVols, np.nan)
\ No newline at end of file